@@ -4,105 +4,80 @@
 import os
 import sys
 import argparse
-import logging
-import subprocess
+import functools
 import time
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from log_utils import setup_logging
 
 # 设置日志记录
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(),
-        logging.FileHandler("backup_all.log")
-    ]
-)
-logger = logging.getLogger("backup_all")
+logger = setup_logging("backup_all.log", "backup_all")
 
-def parse_arguments():
-    """解析命令行参数"""
+@functools.lru_cache(maxsize=1)
+def build_parser():
+    """创建命令行参数解析器，同一进程内只创建一次"""
     parser = argparse.ArgumentParser(description='备份HuggingFace数据集和相关数据库到WebDAV网盘')
     parser.add_argument('--hf-config', default='multi_accounts_config.ini', help='HuggingFace数据集配置文件路径，默认为multi_accounts_config.ini')
     parser.add_argument('--db-config', default='db_config.ini', help='数据库配置文件路径，默认为db_config.ini')
     parser.add_argument('--hf-parallel', type=int, default=3, help='并行备份的数据集数量，默认为3')
     parser.add_argument('--db-parallel', type=int, default=2, help='并行备份的数据库数量，默认为2')
-    parser.add_argument('--hf-only', action='store_true', help='只备份HuggingFace数据集')
-    parser.add_argument('--db-only', action='store_true', help='只备份数据库')
+    # 两个选项同时指定时什么都不会备份，解析参数时直接报错
+    only_group = parser.add_mutually_exclusive_group()
+    only_group.add_argument('--hf-only', action='store_true', help='只备份HuggingFace数据集')
+    only_group.add_argument('--db-only', action='store_true', help='只备份数据库')
     parser.add_argument('--account', help='只备份指定HuggingFace账号的数据集')
     parser.add_argument('--dataset', help='只备份指定HuggingFace数据集')
     parser.add_argument('--database', help='只备份指定数据库')
-    return parser.parse_args()
+    parser.add_argument('--max-failures', type=int, help='数据集或数据库的失败数超过该数量时取消其余尚未开始的备份，不指定则不限制')
+    return parser
+
+def parse_arguments(argv=None):
+    """解析命令行参数"""
+    return build_parser().parse_args(argv)
 
-def backup_huggingface_datasets(config_file, parallel=3, account=None, dataset=None):
+def backup_huggingface_datasets(config_file, parallel=3, account=None, dataset=None, max_failures=None):
     """备份HuggingFace数据集"""
     logger.info("开始备份HuggingFace数据集")
     
-    # 构建备份命令
-    cmd = [
-        sys.executable, 
-        "multi_accounts_backup.py",
-        f"--config={config_file}",
-        f"--parallel={parallel}"
-    ]
-    
-    if account:
-        cmd.append(f"--account={account}")
-        
-    if dataset:
-        cmd.append(f"--dataset={dataset}")
-    
-    # 执行备份命令
+    # 在当前进程中直接调用，复用已加载的模块和日志处理器，避免启动新的解释器
     try:
-        logger.info(f"执行HuggingFace数据集备份命令: {' '.join(cmd)}")
-        result = subprocess.run(cmd, capture_output=True, text=True, check=False)
+        import multi_accounts_backup as hf_mod
         
-        if result.returncode == 0:
+        if hf_mod.run(config_file=config_file, parallel=parallel, account=account, dataset=dataset, max_failures=max_failures):
             logger.info("HuggingFace数据集备份成功")
             return True
         else:
-            logger.error(f"HuggingFace数据集备份失败: {result.stderr}")
+            logger.error("HuggingFace数据集备份失败")
             return False
             
     except Exception as e:
         logger.error(f"执行HuggingFace数据集备份时发生错误: {str(e)}")
         return False
 
-def backup_databases(config_file, parallel=2, database=None):
+def backup_databases(config_file, parallel=2, database=None, max_failures=None):
     """备份数据库"""
     logger.info("开始备份数据库")
     
-    # 构建备份命令
-    cmd = [
-        sys.executable, 
-        "multi_db_backup.py",
-        f"--config={config_file}",
-        f"--parallel={parallel}"
-    ]
-    
-    if database:
-        cmd.append(f"--database={database}")
-    
-    # 执行备份命令
+    # 在当前进程中直接调用，复用已加载的模块和日志处理器，避免启动新的解释器
     try:
-        logger.info(f"执行数据库备份命令: {' '.join(cmd)}")
-        result = subprocess.run(cmd, capture_output=True, text=True, check=False)
+        import multi_db_backup as db_mod
         
-        if result.returncode == 0:
+        if db_mod.run(config_file=config_file, parallel=parallel, database=database, max_failures=max_failures):
             logger.info("数据库备份成功")
             return True
         else:
-            logger.error(f"数据库备份失败: {result.stderr}")
+            logger.error("数据库备份失败")
             return False
             
     except Exception as e:
         logger.error(f"执行数据库备份时发生错误: {str(e)}")
         return False
 
-def main():
-    # 解析命令行参数
-    args = parse_arguments()
+def main(args=None):
+    # 解析命令行参数，被其他脚本调用时可直接传入参数对象
+    if args is None:
+        args = parse_arguments()
     
     # 记录开始时间
     start_time = time.time()
@@ -111,22 +86,37 @@ def main():
     hf_success = True
     db_success = True
     
-    # 备份HuggingFace数据集
-    if not args.db_only:
-        hf_success = backup_huggingface_datasets(
-            args.hf_config, 
-            args.hf_parallel,
-            args.account,
-            args.dataset
-        )
-    
-    # 备份数据库
-    if not args.hf_only:
-        db_success = backup_databases(
-            args.db_config,
-            args.db_parallel,
-            args.database
-        )
+    # HuggingFace数据集和数据库互不依赖，同时备份，总耗时取两者中较长的一个
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        hf_future = None
+        db_future = None
+        
+        # 备份HuggingFace数据集
+        if not args.db_only:
+            hf_future = executor.submit(
+                backup_huggingface_datasets,
+                args.hf_config, 
+                args.hf_parallel,
+                args.account,
+                args.dataset,
+                args.max_failures
+            )
+        
+        # 备份数据库
+        if not args.hf_only:
+            db_future = executor.submit(
+                backup_databases,
+                args.db_config,
+                args.db_parallel,
+                args.database,
+                args.max_failures
+            )
+        
+        if hf_future:
+            hf_success = hf_future.result()
+            
+        if db_future:
+            db_success = db_future.result()
     
     # 计算总耗时
     end_time = time.time()
@@ -147,8 +137,8 @@ def main():
         else:
             logger.error("数据库备份状态: 失败")
     
-    # 设置退出状态码
-    if (not args.db_only and not hf_success) or (not args.hf_only and not db_success):
+    # 设置退出状态码，未执行的部分视为成功
+    if not (hf_success and db_success):
         sys.exit(1)
 
 if __name__ == "__main__":
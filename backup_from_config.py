@@ -5,19 +5,11 @@ import os
 import sys
 import configparser
 import argparse
-import subprocess
-import logging
+import functools
+from log_utils import setup_logging
 
 # 设置日志记录
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(),
-        logging.FileHandler("backup_config.log")
-    ]
-)
-logger = logging.getLogger("backup_config")
+logger = setup_logging("backup_config.log", "backup_config")
 
 def parse_arguments():
     """解析命令行参数"""
@@ -25,6 +17,14 @@ def parse_arguments():
     parser.add_argument('--config', default='config.ini', help='配置文件路径，默认为config.ini')
     return parser.parse_args()
 
+@functools.lru_cache(maxsize=16)
+def _load(config_file, mtime_ns):
+    """解析配置文件为{区段: {选项: 值}}字典，以文件修改时间为键缓存，文件未变化时不再重复解析"""
+    config = configparser.ConfigParser()
+    config.read(config_file)
+    
+    return {section: dict(config.items(section)) for section in config.sections()}
+
 def read_config(config_file):
     """读取配置文件"""
     if not os.path.exists(config_file):
@@ -32,10 +32,7 @@ def read_config(config_file):
         sys.exit(1)
         
     logger.info(f"读取配置文件: {config_file}")
-    config = configparser.ConfigParser()
-    config.read(config_file)
-    
-    return config
+    return _load(config_file, os.stat(config_file).st_mtime_ns)
 
 def main():
     # 解析命令行参数
@@ -44,36 +41,34 @@ def main():
     # 读取配置文件
     config = read_config(args.config)
     
-    # 构建执行命令
+    # 在当前进程中直接调用备份函数，日志实时写入本脚本的日志处理器
     try:
-        cmd = [
-            sys.executable, 
-            "hf_dataset_backup.py",
-            "--hf-token", config.get('huggingface', 'token'),
-            "--dataset", config.get('huggingface', 'dataset'),
-            "--webdav-url", config.get('webdav', 'url'),
-            "--webdav-username", config.get('webdav', 'username'),
-            "--webdav-password", config.get('webdav', 'password'),
-            "--webdav-path", config.get('webdav', 'path'),
-            "--max-backups", config.get('backup', 'max_backups')
-        ]
+        backup_kwargs = {
+            'hf_token': config['huggingface']['token'],
+            'dataset': config['huggingface']['dataset'],
+            'webdav_url': config['webdav']['url'],
+            'webdav_username': config['webdav']['username'],
+            'webdav_password': config['webdav']['password'],
+            'webdav_path': config['webdav']['path'],
+            'max_backups': config['backup']['max_backups']
+        }
+        
+        import hf_dataset_backup
         
         logger.info("开始执行备份")
-        subprocess.run(cmd, check=True)
-        logger.info("备份完成")
+        success, error = hf_dataset_backup.run(**backup_kwargs)
     
-    except configparser.NoSectionError as e:
-        logger.error(f"配置文件缺少必要部分: {str(e)}")
-        sys.exit(1)
-    except configparser.NoOptionError as e:
-        logger.error(f"配置文件缺少必要选项: {str(e)}")
-        sys.exit(1)
-    except subprocess.CalledProcessError as e:
-        logger.error(f"备份过程中出错: {str(e)}")
+    except KeyError as e:
+        logger.error(f"配置文件缺少必要部分或选项: {str(e)}")
         sys.exit(1)
     except Exception as e:
         logger.error(f"发生未知错误: {str(e)}")
         sys.exit(1)
+        
+    if not success:
+        logger.error(f"备份过程中出错: {error}")
+        sys.exit(1)
+    logger.info("备份完成")
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
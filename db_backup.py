@@ -4,30 +4,42 @@
 import os
 import sys
 import argparse
-import logging
+import itertools
+import re
 import tempfile
 import shutil
 import subprocess
 import time
+import zlib
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 import webdav3.client as wc
+from webdav_utils import WebdavSession, WEBDAV_TIMEOUT
+from log_utils import setup_logging
 from pathlib import Path
 
+try:
+    import sqlite3
+except ImportError:
+    # 部分精简编译的Python不带sqlite3模块，此时直接复制数据库文件
+    sqlite3 = None
+
+try:
+    import fcntl
+except ImportError:
+    # Windows下没有fcntl，使用系统默认的管道缓冲区大小
+    fcntl = None
+
 # 设置日志记录
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(),
-        logging.FileHandler("db_backup.log")
-    ]
-)
-logger = logging.getLogger("db_backup")
+logger = setup_logging("db_backup.log", "db_backup")
+
+# 支持的数据库类型，命令行参数和进程内调用共用
+SUPPORTED_DB_TYPES = ('mysql', 'postgresql', 'mongodb', 'sqlite', 'other')
 
 def parse_arguments():
     """解析命令行参数"""
     parser = argparse.ArgumentParser(description='备份数据库到WebDAV网盘')
-    parser.add_argument('--db-type', required=True, choices=['mysql', 'postgresql', 'mongodb', 'sqlite', 'other'], 
+    parser.add_argument('--db-type', required=True, choices=SUPPORTED_DB_TYPES, 
                         help='数据库类型: mysql, postgresql, mongodb, sqlite, other')
     parser.add_argument('--db-name', required=True, help='数据库名称')
     parser.add_argument('--db-user', help='数据库用户名')
@@ -44,8 +56,130 @@ def parse_arguments():
     
     return parser.parse_args()
 
-def backup_mysql(args, backup_file):
-    """备份MySQL/MariaDB数据库"""
+# 流式上传时每次从导出进程读取的数据块大小
+STREAM_CHUNK_SIZE = 1024 * 1024
+
+# 系统中安装了pigz时由pigz进程压缩导出内容，压缩与导出在不同进程中并行进行，否则在当前进程中用zlib压缩
+PIGZ_PATH = shutil.which('pigz')
+
+LOCAL_DB_HOSTS = ('', 'localhost', '127.0.0.1', '::1')
+
+def mysqldump_options(db_host):
+    """返回mysqldump的性能相关参数，连接远程主机时启用协议压缩以减少网络传输量
+
+    不修改--net-buffer-length：导出的INSERT语句长度超过恢复端的max_allowed_packet时无法恢复
+    """
+    if (db_host or '') not in LOCAL_DB_HOSTS:
+        return ['--compress']
+    return []
+
+def enlarge_pipe(pipe, size=STREAM_CHUNK_SIZE):
+    """在Linux下增大管道缓冲区（默认64KB），减少导出进程因管道写满而等待的次数"""
+    if fcntl is None or not hasattr(fcntl, 'F_SETPIPE_SZ'):
+        return
+    try:
+        fcntl.fcntl(pipe.fileno(), fcntl.F_SETPIPE_SZ, size)
+    except OSError:
+        # 超过/proc/sys/fs/pipe-max-size时保持原大小
+        pass
+
+def gzip_chunks(stream, chunk_size=STREAM_CHUNK_SIZE):
+    """逐块读取数据流并压缩为gzip格式的数据块"""
+    compressor = zlib.compressobj(wbits=zlib.MAX_WBITS | 16)
+    
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+            
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+            
+    yield compressor.flush()
+
+def resolve_command(cmd, env=None):
+    """将命令名解析为绝对路径
+
+    subprocess只有在可执行文件带路径且close_fds=False时才使用posix_spawn启动子进程，
+    否则退回fork+exec，需要复制父进程的页表
+    """
+    executable = shutil.which(cmd[0], path=(env or os.environ).get('PATH'))
+    if executable is None:
+        # 找不到命令时保持原样，由Popen抛出FileNotFoundError
+        return cmd
+    return [executable] + cmd[1:]
+
+def stream_dump_to_webdav(cmd, webdav_client, remote_file_path, compress=False, env=None):
+    """执行导出命令，将其标准输出直接流式上传到WebDAV，不在本地生成中间文件"""
+    # 标准错误写入临时文件，避免管道写满导致导出进程阻塞
+    with tempfile.TemporaryFile() as stderr_file:
+        # Python创建的文件描述符默认不可继承，关闭close_fds不会把其他连接泄漏给子进程
+        process = subprocess.Popen(
+            resolve_command(cmd, env),
+            stdout=subprocess.PIPE,
+            stderr=stderr_file,
+            env=env,
+            bufsize=STREAM_CHUNK_SIZE,
+            close_fds=False
+        )
+        enlarge_pipe(process.stdout)
+        compressor = None
+        
+        if compress and PIGZ_PATH:
+            # 导出进程的输出直接接到pigz的标准输入，数据不经过当前进程
+            compressor = subprocess.Popen(
+                [PIGZ_PATH, '-p', str(os.cpu_count() or 1), '-c'],
+                stdin=process.stdout,
+                stdout=subprocess.PIPE,
+                stderr=stderr_file,
+                bufsize=STREAM_CHUNK_SIZE,
+                close_fds=False
+            )
+            # 关闭当前进程持有的读端，pigz退出时导出进程能收到SIGPIPE而不是一直阻塞
+            process.stdout.close()
+            enlarge_pipe(compressor.stdout)
+            output = compressor.stdout
+            chunks = iter(lambda: output.read(STREAM_CHUNK_SIZE), b'')
+        elif compress:
+            output = process.stdout
+            chunks = gzip_chunks(output)
+        else:
+            output = process.stdout
+            chunks = iter(lambda: output.read(STREAM_CHUNK_SIZE), b'')
+            
+        first_chunk = None
+        try:
+            # 等导出命令输出第一块数据后再发起上传请求，避免导出前加锁等待期间服务器因收不到请求体而超时
+            first_chunk = next(chunks, None)
+            if first_chunk is not None:
+                upload_stream_to_webdav(webdav_client, itertools.chain([first_chunk], chunks), remote_file_path)
+        finally:
+            output.close()
+            process.wait()
+            if compressor is not None:
+                compressor.wait()
+                
+        if process.returncode != 0 or (compressor is not None and compressor.returncode != 0):
+            stderr_file.seek(0)
+            logger.error(f"导出命令执行失败: {stderr_file.read().decode('utf-8', errors='replace')}")
+            
+            # 删除已上传的不完整备份文件；没有输出任何数据时不会创建远程文件
+            if first_chunk is not None:
+                try:
+                    webdav_client.clean(remote_file_path)
+                except Exception as e:
+                    logger.warning(f"删除不完整的备份文件时出错: {str(e)}")
+            return False
+            
+        if first_chunk is None:
+            # 导出命令成功但没有任何输出，仍然上传一个空文件
+            upload_stream_to_webdav(webdav_client, iter(()), remote_file_path)
+            
+    return True
+
+def backup_mysql(args, webdav_client, remote_file_path):
+    """备份MySQL/MariaDB数据库，导出内容经gzip压缩后直接上传到WebDAV"""
     logger.info(f"开始备份MySQL数据库: {args.db_name}")
     
     try:
@@ -62,31 +196,51 @@ def backup_mysql(args, backup_file):
         cmd.append('--single-transaction')
         cmd.append('--quick')
         cmd.append('--lock-tables=false')
+        cmd.extend(mysqldump_options(args.db_host))
         cmd.append(args.db_name)
         
-        with open(backup_file, 'wb') as f:
-            process = subprocess.Popen(cmd, stdout=f, stderr=subprocess.PIPE)
-            _, stderr = process.communicate()
-            
-            if process.returncode != 0:
-                logger.error(f"备份MySQL数据库失败: {stderr.decode('utf-8')}")
-                return False
+        if not stream_dump_to_webdav(cmd, webdav_client, remote_file_path, compress=True):
+            logger.error("备份MySQL数据库失败")
+            return False
                 
-        logger.info(f"MySQL数据库备份成功: {backup_file}")
+        logger.info(f"MySQL数据库备份成功: {remote_file_path}")
         return True
             
     except Exception as e:
         logger.error(f"备份MySQL数据库出错: {str(e)}")
         return False
 
-def backup_postgresql(args, backup_file):
-    """备份PostgreSQL数据库"""
+def write_pgpass_file(password):
+    """将密码写入仅当前用户可读写的临时pgpass文件，返回文件路径"""
+    # pgpass格式中的:和\需要转义
+    escaped_password = password.replace('\\', '\\\\').replace(':', '\\:')
+    
+    fd, pgpass_path = tempfile.mkstemp(prefix='pgpass_')
+    with os.fdopen(fd, 'w') as f:
+        f.write(f"*:*:*:*:{escaped_password}\n")
+    return pgpass_path
+
+def pg_dump_env(pgpass_path):
+    """为pg_dump构造环境变量：沿用当前环境，只去掉PGPASSWORD并通过PGPASSFILE指向临时pgpass文件
+
+    保留HOME、语言等变量，libpq仍能找到~/.postgresql下的证书和~/.pg_service.conf
+    """
+    env = os.environ.copy()
+    env.pop('PGPASSWORD', None)
+    env['PGPASSFILE'] = pgpass_path
+    return env
+
+def backup_postgresql(args, webdav_client, remote_file_path):
+    """备份PostgreSQL数据库，导出内容直接上传到WebDAV（custom格式本身已压缩）"""
     logger.info(f"开始备份PostgreSQL数据库: {args.db_name}")
     
+    pgpass_path = None
     try:
-        env = os.environ.copy()
+        # 有密码时通过临时pgpass文件传递，否则沿用当前环境（包括~/.pgpass）
+        env = None
         if args.db_password:
-            env['PGPASSWORD'] = args.db_password
+            pgpass_path = write_pgpass_file(args.db_password)
+            env = pg_dump_env(pgpass_path)
             
         cmd = ['pg_dump']
         
@@ -102,29 +256,27 @@ def backup_postgresql(args, backup_file):
         cmd.append('--format=custom')
         cmd.append(args.db_name)
         
-        with open(backup_file, 'wb') as f:
-            process = subprocess.Popen(cmd, stdout=f, stderr=subprocess.PIPE, env=env)
-            _, stderr = process.communicate()
-            
-            if process.returncode != 0:
-                logger.error(f"备份PostgreSQL数据库失败: {stderr.decode('utf-8')}")
-                return False
+        if not stream_dump_to_webdav(cmd, webdav_client, remote_file_path, env=env):
+            logger.error("备份PostgreSQL数据库失败")
+            return False
                 
-        logger.info(f"PostgreSQL数据库备份成功: {backup_file}")
+        logger.info(f"PostgreSQL数据库备份成功: {remote_file_path}")
         return True
             
     except Exception as e:
         logger.error(f"备份PostgreSQL数据库出错: {str(e)}")
         return False
+    finally:
+        if pgpass_path:
+            os.unlink(pgpass_path)
 
-def backup_mongodb(args, backup_file):
-    """备份MongoDB数据库"""
+def backup_mongodb(args, webdav_client, remote_file_path):
+    """备份MongoDB数据库，mongodump以gzip压缩的归档格式输出并直接上传到WebDAV"""
     logger.info(f"开始备份MongoDB数据库: {args.db_name}")
     
     try:
-        dump_dir = tempfile.mkdtemp()
-        
-        cmd = ['mongodump', f'--db={args.db_name}', f'--out={dump_dir}']
+        # 不指定--archive的路径时归档写到标准输出
+        cmd = ['mongodump', f'--db={args.db_name}', '--archive', '--gzip']
         
         if args.db_user and args.db_password:
             cmd.append(f'--username={args.db_user}')
@@ -137,31 +289,39 @@ def backup_mongodb(args, backup_file):
         if args.db_port:
             cmd.append(f'--port={args.db_port}')
             
-        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        _, stderr = process.communicate()
-        
-        if process.returncode != 0:
-            logger.error(f"备份MongoDB数据库失败: {stderr.decode('utf-8')}")
-            shutil.rmtree(dump_dir, ignore_errors=True)
+        if not stream_dump_to_webdav(cmd, webdav_client, remote_file_path):
+            logger.error("备份MongoDB数据库失败")
             return False
-            
-        # 创建压缩文件
-        shutil.make_archive(
-            backup_file.replace('.zip', ''),
-            'zip',
-            dump_dir
-        )
         
-        # 清理临时目录
-        shutil.rmtree(dump_dir, ignore_errors=True)
-        
-        logger.info(f"MongoDB数据库备份成功: {backup_file}")
+        logger.info(f"MongoDB数据库备份成功: {remote_file_path}")
         return True
             
     except Exception as e:
         logger.error(f"备份MongoDB数据库出错: {str(e)}")
         return False
 
+# SQLite在线备份每一步复制的页数
+SQLITE_BACKUP_PAGES = 1024
+
+# 每次调用copy_file_range最多复制的字节数
+COPY_FILE_RANGE_SIZE = 1 << 30
+
+def copy_file(src_path, dst_path):
+    """复制文件内容及元数据，Linux下使用copy_file_range在内核中完成复制"""
+    if hasattr(os, 'copy_file_range'):
+        try:
+            with open(src_path, 'rb') as src, open(dst_path, 'wb') as dst:
+                while os.copy_file_range(src.fileno(), dst.fileno(), COPY_FILE_RANGE_SIZE):
+                    pass
+            shutil.copystat(src_path, dst_path)
+            return
+        except OSError:
+            # 文件系统不支持时退回到普通复制
+            pass
+            
+    shutil.copyfile(src_path, dst_path)
+    shutil.copystat(src_path, dst_path)
+
 def backup_sqlite(args, backup_file):
     """备份SQLite数据库"""
     logger.info(f"开始备份SQLite数据库: {args.db_file}")
@@ -171,8 +331,20 @@ def backup_sqlite(args, backup_file):
             logger.error(f"SQLite数据库文件不存在: {args.db_file}")
             return False
             
-        # 直接复制数据库文件
-        shutil.copy2(args.db_file, backup_file)
+        if sqlite3 is None:
+            copy_file(args.db_file, backup_file)
+            logger.info(f"SQLite数据库备份成功: {backup_file}")
+            return True
+            
+        # 使用SQLite在线备份接口按页复制，数据库正在被写入时也能得到一致的快照
+        src = sqlite3.connect(args.db_file)
+        dst = sqlite3.connect(backup_file)
+        try:
+            with dst:
+                src.backup(dst, pages=SQLITE_BACKUP_PAGES)
+        finally:
+            dst.close()
+            src.close()
         
         logger.info(f"SQLite数据库备份成功: {backup_file}")
         return True
@@ -198,13 +370,14 @@ def backup_other(args, backup_file):
         cmd = cmd.replace('{db_host}', args.db_host if args.db_host else '')
         cmd = cmd.replace('{db_port}', args.db_port if args.db_port else '')
         
-        # 执行命令
-        process = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        _, stderr = process.communicate()
-        
-        if process.returncode != 0:
-            logger.error(f"使用自定义命令备份数据库失败: {stderr.decode('utf-8')}")
-            return False
+        # 执行命令，标准错误写入临时文件，只在失败时读取；shell为/bin/sh，不关闭close_fds即可使用posix_spawn
+        with tempfile.TemporaryFile() as stderr_file:
+            result = subprocess.run(cmd, shell=True, stdout=subprocess.DEVNULL, stderr=stderr_file, check=False, close_fds=False)
+            
+            if result.returncode != 0:
+                stderr_file.seek(0)
+                logger.error(f"使用自定义命令备份数据库失败: {stderr_file.read().decode('utf-8', errors='replace')}")
+                return False
             
         logger.info(f"数据库备份成功: {backup_file}")
         return True
@@ -219,10 +392,20 @@ def setup_webdav_client(url, username, password):
         'webdav_hostname': url,
         'webdav_login': username,
         'webdav_password': password,
-        'webdav_timeout': 300  # 5分钟超时
+        'webdav_timeout': WEBDAV_TIMEOUT
     }
     return wc.Client(options)
 
+def ensure_remote_dir(webdav_client, remote_path):
+    """确保远程目录存在，缺少的上级目录一并创建，已确认存在的目录不再请求"""
+    webdav_client.ensure_dir(remote_path)
+
+def upload_stream_to_webdav(webdav_client, chunks, remote_file_path):
+    """将数据块迭代器作为请求体上传到WebDAV（分块传输编码），上传开始前无需知道总大小"""
+    logger.info(f"正在流式上传文件到WebDAV: {remote_file_path}")
+    webdav_client.upload_stream(chunks, remote_file_path)
+    logger.info(f"文件上传成功: {remote_file_path}")
+
 def upload_to_webdav(webdav_client, local_file, remote_path):
     """上传文件到WebDAV服务器"""
     logger.info(f"正在上传文件到WebDAV: {remote_path}")
@@ -231,8 +414,7 @@ def upload_to_webdav(webdav_client, local_file, remote_path):
         remote_file_path = remote_path + filename
         
         # 确保远程目录存在
-        if not webdav_client.check(remote_path):
-            webdav_client.mkdir(remote_path)
+        ensure_remote_dir(webdav_client, remote_path)
             
         # 上传文件
         webdav_client.upload_sync(
@@ -245,6 +427,9 @@ def upload_to_webdav(webdav_client, local_file, remote_path):
         logger.error(f"上传文件时出错: {str(e)}")
         raise
 
+# 清理旧备份时并行删除的最大请求数
+CLEANUP_WORKERS = 8
+
 def cleanup_old_backups(webdav_client, remote_path, db_name, max_backups):
     """清理旧的备份文件，只保留指定数量的最新备份"""
     logger.info(f"清理旧的备份文件，保留最新的{max_backups}个备份")
@@ -253,8 +438,9 @@ def cleanup_old_backups(webdav_client, remote_path, db_name, max_backups):
         # 列出远程目录中的所有文件
         files = webdav_client.list(remote_path)
         
-        # 过滤出与当前数据库相关的备份文件
-        backup_files = [f for f in files if f.startswith(db_name) and (f.endswith('.sql') or f.endswith('.dump') or f.endswith('.zip') or f.endswith('.db'))]
+        # 过滤出与当前数据库相关的备份文件，名称后须紧跟完整的时间戳，名为foo的数据库不会匹配到foo_bar的备份
+        pattern = re.compile(rf'^{re.escape(db_name)}_\d{{8}}_\d{{6}}\.')
+        backup_files = [f for f in files if pattern.match(f) and (f.endswith('.sql') or f.endswith('.sql.gz') or f.endswith('.dump') or f.endswith('.archive.gz') or f.endswith('.zip') or f.endswith('.db'))]
         
         if len(backup_files) <= max_backups:
             logger.info(f"备份文件数量未超过限制({len(backup_files)}/{max_backups})，无需清理")
@@ -266,78 +452,118 @@ def cleanup_old_backups(webdav_client, remote_path, db_name, max_backups):
         # 确定需要删除的文件数量
         files_to_delete = len(backup_files) - max_backups
         
-        # 删除旧文件
-        for i in range(files_to_delete):
-            file_to_delete = remote_path + backup_files[i]
+        # 并行删除旧文件，每个删除请求都是一次独立的网络往返
+        def delete_backup(file_name):
+            file_to_delete = remote_path + file_name
             logger.info(f"删除旧备份文件: {file_to_delete}")
             webdav_client.clean(file_to_delete)
             
+        with ThreadPoolExecutor(max_workers=CLEANUP_WORKERS) as executor:
+            list(executor.map(delete_backup, backup_files[:files_to_delete]))
+            
         logger.info(f"清理完成，已删除{files_to_delete}个旧备份文件")
     except Exception as e:
         logger.error(f"清理旧备份文件时出错: {str(e)}")
         raise
 
-def main():
-    # 解析命令行参数
-    args = parse_arguments()
+def create_webdav_session(url, username, password):
+    """创建WebDAV客户端，并在本次备份过程中缓存远程目录列表"""
+    return WebdavSession(setup_webdav_client(url, username, password))
+
+def run(db_type, db_name, webdav_url, webdav_username, webdav_password, webdav_path, max_backups=2, **db_options):
+    """执行单个数据库的备份，返回(是否成功, 错误信息)"""
+    try:
+        webdav_client = create_webdav_session(webdav_url, webdav_username, webdav_password)
+    except Exception as e:
+        logger.error(f"创建WebDAV客户端时出错: {str(e)}")
+        return False, str(e)
+        
+    return run_with_client(webdav_client, db_type, db_name, webdav_path, max_backups, **db_options)
+
+def run_with_client(webdav_client, db_type, db_name, webdav_path, max_backups=2,
+                    db_user=None, db_password=None, db_host=None, db_port=None, db_file=None, custom_cmd=None):
+    """使用给定的WebDAV客户端备份单个数据库，返回(是否成功, 错误信息)，供multi_db_backup.py在进程内直接调用"""
+    # 进程内调用不经过argparse的choices检查，需在这里拒绝不支持的类型
+    if db_type not in SUPPORTED_DB_TYPES:
+        logger.error(f"不支持的数据库类型: {db_type}")
+        return False, f"不支持的数据库类型: {db_type}"
+        
+    args = argparse.Namespace(
+        db_type=db_type,
+        db_name=db_name,
+        db_user=db_user,
+        db_password=db_password,
+        db_host=db_host,
+        db_port=db_port,
+        db_file=db_file,
+        custom_cmd=custom_cmd,
+        max_backups=int(max_backups)
+    )
     
     # 确保WebDAV路径以/结尾
-    webdav_path = args.webdav_path
     if not webdav_path.endswith('/'):
         webdav_path += '/'
     
-    # 创建临时目录
-    with tempfile.TemporaryDirectory() as temp_dir:
-        # 生成备份文件名
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    # 生成备份文件名
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    
+    try:
+        if args.db_type in ('mysql', 'postgresql', 'mongodb'):
+            # MySQL、PostgreSQL和MongoDB的导出结果直接流式上传，不在本地落盘
+            ensure_remote_dir(webdav_client, webdav_path)
+            
+            if args.db_type == 'mysql':
+                backup_file_name = f"{args.db_name}_{timestamp}.sql.gz"
+                success = backup_mysql(args, webdav_client, webdav_path + backup_file_name)
+            elif args.db_type == 'mongodb':
+                backup_file_name = f"{args.db_name}_{timestamp}.archive.gz"
+                success = backup_mongodb(args, webdav_client, webdav_path + backup_file_name)
+            else:
+                backup_file_name = f"{args.db_name}_{timestamp}.dump"
+                success = backup_postgresql(args, webdav_client, webdav_path + backup_file_name)
+                
+            if not success:
+                logger.error("数据库备份失败")
+                return False, "数据库备份失败"
+        else:
+            # 创建临时目录
+            with tempfile.TemporaryDirectory() as temp_dir:
+                backup_file_name = None
+                backup_file_path = None
+                
+                if args.db_type == 'sqlite':
+                    backup_file_name = f"{args.db_name}_{timestamp}.db"
+                    backup_file_path = os.path.join(temp_dir, backup_file_name)
+                    success = backup_sqlite(args, backup_file_path)
+                elif args.db_type == 'other':
+                    backup_file_name = f"{args.db_name}_{timestamp}.backup"
+                    backup_file_path = os.path.join(temp_dir, backup_file_name)
+                    success = backup_other(args, backup_file_path)
+                
+                if not success:
+                    logger.error("数据库备份失败")
+                    return False, "数据库备份失败"
+                    
+                # 上传文件到WebDAV
+                upload_to_webdav(webdav_client, backup_file_path, webdav_path)
         
-        backup_file_name = None
-        backup_file_path = None
+        # 清理旧的备份文件
+        cleanup_old_backups(webdav_client, webdav_path, args.db_name, args.max_backups)
         
-        if args.db_type == 'mysql':
-            backup_file_name = f"{args.db_name}_{timestamp}.sql"
-            backup_file_path = os.path.join(temp_dir, backup_file_name)
-            success = backup_mysql(args, backup_file_path)
-        elif args.db_type == 'postgresql':
-            backup_file_name = f"{args.db_name}_{timestamp}.dump"
-            backup_file_path = os.path.join(temp_dir, backup_file_name)
-            success = backup_postgresql(args, backup_file_path)
-        elif args.db_type == 'mongodb':
-            backup_file_name = f"{args.db_name}_{timestamp}.zip"
-            backup_file_path = os.path.join(temp_dir, backup_file_name)
-            success = backup_mongodb(args, backup_file_path)
-        elif args.db_type == 'sqlite':
-            backup_file_name = f"{args.db_name}_{timestamp}.db"
-            backup_file_path = os.path.join(temp_dir, backup_file_name)
-            success = backup_sqlite(args, backup_file_path)
-        elif args.db_type == 'other':
-            backup_file_name = f"{args.db_name}_{timestamp}.backup"
-            backup_file_path = os.path.join(temp_dir, backup_file_name)
-            success = backup_other(args, backup_file_path)
+        logger.info("备份过程完成")
+        return True, None
         
-        if not success:
-            logger.error("数据库备份失败")
-            sys.exit(1)
-            
-        try:
-            # 设置WebDAV客户端
-            webdav_client = setup_webdav_client(
-                args.webdav_url,
-                args.webdav_username,
-                args.webdav_password
-            )
-            
-            # 上传文件到WebDAV
-            upload_to_webdav(webdav_client, backup_file_path, webdav_path)
-            
-            # 清理旧的备份文件
-            cleanup_old_backups(webdav_client, webdav_path, args.db_name, args.max_backups)
-            
-            logger.info("备份过程完成")
-            
-        except Exception as e:
-            logger.error(f"备份过程中发生错误: {str(e)}")
-            sys.exit(1)
+    except Exception as e:
+        logger.error(f"备份过程中发生错误: {str(e)}")
+        return False, str(e)
+
+def main():
+    # 解析命令行参数
+    args = parse_arguments()
+    
+    success, _ = run(**vars(args))
+    if not success:
+        sys.exit(1)
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
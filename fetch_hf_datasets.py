@@ -4,20 +4,13 @@
 import os
 import sys
 import argparse
-import logging
 import configparser
+import functools
 from huggingface_hub import HfApi, logging as hf_logging
+from log_utils import setup_logging
 
 # 设置日志记录
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(),
-        logging.FileHandler("fetch_datasets.log")
-    ]
-)
-logger = logging.getLogger("fetch_datasets")
+logger = setup_logging("fetch_datasets.log", "fetch_datasets")
 
 # 禁用HuggingFace的详细日志
 hf_logging.set_verbosity_error()
@@ -31,43 +24,58 @@ def parse_arguments():
     parser.add_argument('--account-section', help='要更新的账号配置区段名称（例如：account:myaccount）')
     return parser.parse_args()
 
+# 所有请求共用同一个HfApi实例（及其HTTP连接），令牌按请求传入
+_api = HfApi()
+
 def get_user_datasets(token, username):
     """获取指定用户的所有数据集"""
     logger.info(f"正在获取用户 {username} 的数据集列表...")
     
-    api = HfApi(token=token)
-    
     try:
-        # 获取用户的所有数据集
-        datasets = api.list_datasets(author=username)
-        logger.info(f"找到 {len(datasets)} 个数据集")
+        # list_datasets返回按页请求的迭代器，遍历一次即得到数据集ID列表
+        dataset_ids = [dataset.id for dataset in _api.list_datasets(author=username, token=token)]
+        logger.info(f"找到 {len(dataset_ids)} 个数据集")
         
-        # 返回数据集ID列表
-        return [dataset.id for dataset in datasets]
+        return dataset_ids
     except Exception as e:
         logger.error(f"获取数据集列表时出错: {str(e)}")
         return []
 
+@functools.lru_cache(maxsize=16)
+def _load(config_file, mtime_ns):
+    """解析配置文件为{区段: {选项: 值}}字典，以文件修改时间为键缓存，文件未变化时不再重复解析"""
+    config = configparser.ConfigParser()
+    config.read(config_file)
+    
+    return {section: dict(config.items(section, raw=True)) for section in config.sections()}
+
 def update_config_file(config_file, account_section, datasets):
     """更新配置文件中的数据集列表"""
     if not os.path.exists(config_file):
         logger.error(f"配置文件不存在: {config_file}")
         return False
         
-    config = configparser.ConfigParser()
-    config.read(config_file)
+    sections = _load(config_file, os.stat(config_file).st_mtime_ns)
     
-    if not config.has_section(account_section):
+    if account_section not in sections:
         logger.error(f"配置文件中不存在区段: {account_section}")
         return False
         
-    # 更新数据集列表
+    # 数据集列表没有变化时无需重写配置文件
     datasets_str = ", ".join(datasets)
+    if sections[account_section].get('datasets') == datasets_str:
+        logger.info(f"配置文件 {config_file} 中的数据集列表已是最新")
+        return True
+        
+    # 更新数据集列表
+    config = configparser.ConfigParser()
+    config.read(config_file)
     config.set(account_section, 'datasets', datasets_str)
     
     # 保存配置文件
     with open(config_file, 'w') as configfile:
         config.write(configfile)
+    _load.cache_clear()
         
     logger.info(f"已更新配置文件 {config_file} 中的数据集列表")
     return True
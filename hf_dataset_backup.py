@@ -4,32 +4,36 @@
 import os
 import sys
 import argparse
-import logging
-import tempfile
+import re
 import shutil
 import time
+import zipfile
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import importlib.util
 import requests
-from huggingface_hub import snapshot_download, HfApi
+
+# 安装了hf_transfer时启用其并行分段下载，必须在导入huggingface_hub之前设置
+# 未安装时不能设置该变量，否则huggingface_hub下载时会报错
+if importlib.util.find_spec('hf_transfer') is not None:
+    os.environ.setdefault('HF_HUB_ENABLE_HF_TRANSFER', '1')
+
+from huggingface_hub import hf_hub_download, HfApi
 import webdav3.client as wc
+from webdav_utils import WebdavSession, upload_from_writer, WEBDAV_TIMEOUT
+from log_utils import setup_logging
 from pathlib import Path
 
 # 设置日志记录
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(),
-        logging.FileHandler("hf_backup.log")
-    ]
-)
-logger = logging.getLogger("hf_backup")
+logger = setup_logging("hf_backup.log", "hf_backup")
 
 def parse_arguments():
     """解析命令行参数"""
     parser = argparse.ArgumentParser(description='备份HuggingFace数据集到WebDAV网盘')
     parser.add_argument('--hf-token', required=True, help='HuggingFace API令牌')
-    parser.add_argument('--dataset', required=True, help='要备份的数据集，格式为"用户名/数据集名称"')
+    dataset_group = parser.add_mutually_exclusive_group(required=True)
+    dataset_group.add_argument('--dataset', help='要备份的数据集，格式为"用户名/数据集名称"')
+    dataset_group.add_argument('--datasets', help='要备份的多个数据集，用逗号分隔，共用同一个WebDAV连接依次备份')
     parser.add_argument('--webdav-url', required=True, help='WebDAV服务器URL')
     parser.add_argument('--webdav-username', required=True, help='WebDAV用户名')
     parser.add_argument('--webdav-password', required=True, help='WebDAV密码')
@@ -38,39 +42,84 @@ def parse_arguments():
     
     return parser.parse_args()
 
-def download_dataset(dataset_name, hf_token, temp_dir):
-    """从HuggingFace下载数据集"""
-    logger.info(f"开始下载数据集: {dataset_name}")
+def get_dataset_revision(dataset_name, hf_token):
+    """获取数据集当前的提交SHA，获取失败时返回None"""
     try:
-        # 下载数据集快照
-        snapshot_path = snapshot_download(
-            repo_id=dataset_name,
-            repo_type="dataset",
-            token=hf_token,
-            local_dir=temp_dir,
-            local_dir_use_symlinks=False
-        )
-        logger.info(f"数据集下载完成: {snapshot_path}")
-        return snapshot_path
+        return HfApi(token=hf_token).dataset_info(dataset_name).sha
     except Exception as e:
-        logger.error(f"下载数据集时出错: {str(e)}")
-        raise
+        logger.warning(f"获取数据集修订版本时出错: {str(e)}")
+        return None
+
+# 下载数据集时并行下载的文件数
+HF_DOWNLOAD_WORKERS = min(16, (os.cpu_count() or 1) * 4)
 
-def create_archive(source_dir, dataset_name):
-    """创建数据集的压缩文件"""
+# 备份文件名中保存的修订版本SHA长度
+REVISION_LENGTH = 7
+
+# 写入压缩包时每次复制的数据块大小
+ARCHIVE_COPY_BUFFER_SIZE = 4 * 1024 * 1024
+
+def get_archive_name(dataset_name, revision=None):
+    """生成备份文件名，文件名中附带修订版本的短SHA"""
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     dataset_short_name = dataset_name.split('/')[-1]
-    archive_name = f"{dataset_short_name}_{timestamp}.zip"
-    archive_path = os.path.join(tempfile.gettempdir(), archive_name)
+    if revision:
+        return f"{dataset_short_name}_{timestamp}_{revision[:REVISION_LENGTH]}.zip"
+    return f"{dataset_short_name}_{timestamp}.zip"
+
+def add_file_to_zip(zf, file_path, arcname):
+    """将单个文件以不压缩方式按大块写入压缩包"""
+    zinfo = zipfile.ZipInfo.from_file(file_path, arcname)
+    zinfo.compress_type = zipfile.ZIP_STORED
     
-    logger.info(f"正在创建压缩文件: {archive_path}")
-    shutil.make_archive(
-        archive_path.replace('.zip', ''),  # 去掉.zip后缀，因为make_archive会自动添加
-        'zip',
-        source_dir
-    )
+    with open(file_path, 'rb') as src, zf.open(zinfo, 'w', force_zip64=True) as dst:
+        shutil.copyfileobj(src, dst, ARCHIVE_COPY_BUFFER_SIZE)
+
+def write_dataset_archive(writer, dataset_name, hf_token, revision=None):
+    """并行下载数据集中的文件到HuggingFace缓存，每下载完一个就从缓存读取并写入压缩包
+
+    不再把文件复制到临时目录，缓存中内容未变的文件在之后的运行中无需重新下载
+    """
+    files = HfApi(token=hf_token).list_repo_files(dataset_name, repo_type="dataset", revision=revision)
+    logger.info(f"数据集 {dataset_name} 共有{len(files)}个文件")
     
-    return archive_path + '.zip'  # 返回完整路径，包括.zip后缀
+    executor = ThreadPoolExecutor(max_workers=HF_DOWNLOAD_WORKERS)
+    futures = {}
+    try:
+        futures = {
+            executor.submit(
+                hf_hub_download,
+                repo_id=dataset_name,
+                filename=filename,
+                repo_type="dataset",
+                revision=revision,
+                token=hf_token
+            ): filename
+            for filename in files
+        }
+        
+        # HF数据集中的parquet/arrow等文件本身已压缩，直接存储以免浪费CPU重复压缩
+        with zipfile.ZipFile(writer, 'w', zipfile.ZIP_STORED, allowZip64=True) as zf:
+            for future in as_completed(futures):
+                local_path = future.result()
+                add_file_to_zip(zf, local_path, futures[future])
+    except BaseException:
+        for future in futures:
+            future.cancel()
+        raise
+    finally:
+        executor.shutdown(wait=True)
+
+def stream_dataset_to_webdav(webdav_client, dataset_name, hf_token, remote_file_path, revision=None):
+    """边下载边压缩边上传：下载、写压缩包与上传同时进行，压缩包不在本地落盘"""
+    logger.info(f"开始下载数据集并流式上传到WebDAV: {dataset_name} -> {remote_file_path}")
+    upload_from_writer(
+        webdav_client,
+        remote_file_path,
+        lambda writer: write_dataset_archive(writer, dataset_name, hf_token, revision)
+    )
+    logger.info(f"文件上传成功: {remote_file_path}")
+    return remote_file_path
 
 def setup_webdav_client(url, username, password):
     """设置WebDAV客户端"""
@@ -78,35 +127,44 @@ def setup_webdav_client(url, username, password):
         'webdav_hostname': url,
         'webdav_login': username,
         'webdav_password': password,
-        'webdav_timeout': 300  # 5分钟超时
+        'webdav_timeout': WEBDAV_TIMEOUT
     }
     return wc.Client(options)
 
-def upload_to_webdav(webdav_client, local_file, remote_path):
-    """上传文件到WebDAV服务器"""
-    logger.info(f"正在上传文件到WebDAV: {remote_path}")
+def ensure_remote_dir(webdav_client, remote_path):
+    """确保远程目录存在，缺少的上级目录一并创建，已确认存在的目录不再请求"""
+    webdav_client.ensure_dir(remote_path)
+
+def backup_file_pattern(dataset_name):
+    """匹配该数据集的备份文件名：短名称_时间戳[_修订版本短SHA].zip，修订版本为第1组
+
+    要求短名称后紧跟完整的时间戳，名为foo的数据集不会匹配到foo_bar的备份
+    """
+    dataset_short_name = dataset_name.split('/')[-1]
+    return re.compile(rf'^{re.escape(dataset_short_name)}_\d{{8}}_\d{{6}}(?:_([0-9a-f]{{{REVISION_LENGTH}}}))?\.zip$')
+
+def latest_backup_revision(webdav_client, remote_path, dataset_name):
+    """从远程目录中最新备份的文件名读取其修订版本短SHA，没有可用信息时返回None"""
+    pattern = backup_file_pattern(dataset_name)
+    
     try:
-        filename = os.path.basename(local_file)
-        remote_file_path = remote_path + filename
-        
-        # 确保远程目录存在
-        if not webdav_client.check(remote_path):
-            webdav_client.mkdir(remote_path)
-            
-        # 上传文件
-        webdav_client.upload_sync(
-            remote_path=remote_file_path,
-            local_path=local_file
-        )
-        logger.info(f"文件上传成功: {remote_file_path}")
-        return remote_file_path
+        files = webdav_client.list(remote_path)
     except Exception as e:
-        logger.error(f"上传文件时出错: {str(e)}")
-        raise
+        logger.info(f"无法列出远程目录 {remote_path}: {str(e)}")
+        return None
+        
+    backup_files = sorted(f for f in files if pattern.match(f))
+    if not backup_files:
+        return None
+        
+    return pattern.match(backup_files[-1]).group(1)
+
+# 清理旧备份时并行删除的最大请求数
+CLEANUP_WORKERS = 8
 
 def cleanup_old_backups(webdav_client, remote_path, dataset_name, max_backups):
     """清理旧的备份文件，只保留指定数量的最新备份"""
-    dataset_short_name = dataset_name.split('/')[-1]
+    pattern = backup_file_pattern(dataset_name)
     logger.info(f"清理旧的备份文件，保留最新的{max_backups}个备份")
     
     try:
@@ -114,7 +172,7 @@ def cleanup_old_backups(webdav_client, remote_path, dataset_name, max_backups):
         files = webdav_client.list(remote_path)
         
         # 过滤出与当前数据集相关的备份文件
-        backup_files = [f for f in files if f.startswith(dataset_short_name) and f.endswith('.zip')]
+        backup_files = [f for f in files if pattern.match(f)]
         
         if len(backup_files) <= max_backups:
             logger.info(f"备份文件数量未超过限制({len(backup_files)}/{max_backups})，无需清理")
@@ -126,67 +184,97 @@ def cleanup_old_backups(webdav_client, remote_path, dataset_name, max_backups):
         # 确定需要删除的文件数量
         files_to_delete = len(backup_files) - max_backups
         
-        # 删除旧文件
-        for i in range(files_to_delete):
-            file_to_delete = remote_path + backup_files[i]
+        # 并行删除旧文件，每个删除请求都是一次独立的网络往返
+        def delete_backup(file_name):
+            file_to_delete = remote_path + file_name
             logger.info(f"删除旧备份文件: {file_to_delete}")
             webdav_client.clean(file_to_delete)
             
+        with ThreadPoolExecutor(max_workers=CLEANUP_WORKERS) as executor:
+            list(executor.map(delete_backup, backup_files[:files_to_delete]))
+            
         logger.info(f"清理完成，已删除{files_to_delete}个旧备份文件")
     except Exception as e:
         logger.error(f"清理旧备份文件时出错: {str(e)}")
         raise
 
-def main():
-    # 解析命令行参数
-    args = parse_arguments()
-    
-    # 创建临时目录
-    temp_dir = tempfile.mkdtemp()
-    logger.info(f"创建临时目录: {temp_dir}")
-    
+def is_backup_current(webdav_client, webdav_path, dataset, revision):
+    """判断最新备份是否已经是该修订版本"""
+    return bool(revision) and latest_backup_revision(webdav_client, webdav_path, dataset) == revision[:REVISION_LENGTH]
+
+def check_dataset_changed(webdav_client, hf_token, dataset, webdav_path):
+    """查询数据集当前修订版本并与最新备份比较，返回(是否需要备份, 修订版本SHA)"""
+    revision = get_dataset_revision(dataset, hf_token)
+    return not is_backup_current(webdav_client, webdav_path, dataset, revision), revision
+
+def backup_dataset(webdav_client, hf_token, dataset, webdav_path, max_backups, revision=None):
+    """使用已建立的WebDAV客户端备份单个数据集，返回(是否成功, 错误信息)
+
+    调用方已查询过修订版本时可直接传入，避免重复请求HuggingFace
+    """
     try:
-        # 下载数据集
-        dataset_path = download_dataset(args.dataset, args.hf_token, temp_dir)
-        
-        # 创建压缩文件
-        archive_path = create_archive(dataset_path, args.dataset)
-        
-        # 设置WebDAV客户端
-        webdav_client = setup_webdav_client(
-            args.webdav_url,
-            args.webdav_username,
-            args.webdav_password
-        )
-        
-        # 确保WebDAV路径以/结尾
-        webdav_path = args.webdav_path
-        if not webdav_path.endswith('/'):
-            webdav_path += '/'
+        # 数据集修订版本与最新备份一致时，跳过下载、压缩和上传
+        if revision is None:
+            revision = get_dataset_revision(dataset, hf_token)
+        if is_backup_current(webdav_client, webdav_path, dataset, revision):
+            logger.info(f"数据集 {dataset} 的修订版本 {revision[:REVISION_LENGTH]} 未变化，跳过备份")
+            return True, None
             
-        # 上传文件到WebDAV
-        upload_to_webdav(webdav_client, archive_path, webdav_path)
+        # 下载数据集，同时打包并上传到WebDAV
+        ensure_remote_dir(webdav_client, webdav_path)
+        archive_name = get_archive_name(dataset, revision)
+        stream_dataset_to_webdav(webdav_client, dataset, hf_token, webdav_path + archive_name, revision)
         
         # 清理旧的备份文件
-        cleanup_old_backups(webdav_client, webdav_path, args.dataset, args.max_backups)
+        cleanup_old_backups(webdav_client, webdav_path, dataset, int(max_backups))
         
-        logger.info("备份过程完成")
+        logger.info(f"数据集 {dataset} 备份过程完成")
+        return True, None
         
     except Exception as e:
-        logger.error(f"备份过程中发生错误: {str(e)}")
-        sys.exit(1)
-    finally:
-        # 清理临时文件
-        logger.info(f"清理临时目录: {temp_dir}")
-        shutil.rmtree(temp_dir, ignore_errors=True)
+        logger.error(f"备份数据集 {dataset} 过程中发生错误: {str(e)}")
+        return False, str(e)
+
+def create_webdav_session(url, username, password):
+    """创建WebDAV客户端，并在本次备份过程中缓存远程目录列表"""
+    return WebdavSession(setup_webdav_client(url, username, password))
+
+def run_batch(webdav_client, hf_token, datasets, webdav_path, max_backups=2, revisions=None):
+    """使用给定的WebDAV客户端依次备份同一令牌、同一WebDAV目录下的多个数据集，返回[(数据集, 是否成功, 错误信息)]
+
+    所有数据集共用一个WebDAV客户端，远程目录只需列出一次；revisions为已查询到的{数据集: 修订版本SHA}
+    """
+    # 确保WebDAV路径以/结尾
+    if not webdav_path.endswith('/'):
+        webdav_path += '/'
         
-        # 尝试删除临时压缩文件
-        try:
-            if 'archive_path' in locals() and os.path.exists(archive_path):
-                os.remove(archive_path)
-                logger.info(f"删除临时压缩文件: {archive_path}")
-        except Exception as e:
-            logger.warning(f"删除临时压缩文件时出错: {str(e)}")
+    results = []
+    for dataset in datasets:
+        revision = revisions.get(dataset) if revisions else None
+        success, error = backup_dataset(webdav_client, hf_token, dataset, webdav_path, max_backups, revision)
+        results.append((dataset, success, error))
+    return results
+
+def run(hf_token, dataset, webdav_url, webdav_username, webdav_password, webdav_path, max_backups=2):
+    """执行单个数据集的备份，返回(是否成功, 错误信息)，供其他脚本在进程内直接调用"""
+    webdav_client = create_webdav_session(webdav_url, webdav_username, webdav_password)
+    _, success, error = run_batch(webdav_client, hf_token, [dataset], webdav_path, max_backups)[0]
+    return success, error
+
+def main():
+    # 解析命令行参数
+    args = parse_arguments()
+    
+    if args.dataset:
+        datasets = [args.dataset]
+    else:
+        datasets = [ds.strip() for ds in args.datasets.split(',') if ds.strip()]
+        
+    webdav_client = create_webdav_session(args.webdav_url, args.webdav_username, args.webdav_password)
+    results = run_batch(webdav_client, args.hf_token, datasets, args.webdav_path, args.max_backups)
+    
+    if not all(success for _, success, _ in results):
+        sys.exit(1)
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+
+import atexit
+import logging
+import logging.handlers
+import queue
+import threading
+import time
+
+# 日志格式中不使用进程、线程信息，关闭记录这些字段以减少每条日志的开销
+logging.logProcesses = False
+logging.logThreads = False
+logging.logMultiprocessing = False
+
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# 单个日志文件的最大字节数和保留的历史日志文件数量
+LOG_MAX_BYTES = 50 * 1024 * 1024
+LOG_BACKUP_COUNT = 5
+
+# 文件日志缓存定期写入磁盘的间隔（秒），进程被强制结束时最多丢失这段时间内的日志
+LOG_FLUSH_INTERVAL = 5
+
+class CachedTimeFormatter(logging.Formatter):
+    """同一秒内的日志记录复用已格式化的时间字符串，避免每条日志都调用strftime"""
+
+    def __init__(self, fmt=LOG_FORMAT, datefmt=DATE_FORMAT):
+        super().__init__(fmt, datefmt)
+        self._cached_time = (None, None)
+
+    def formatTime(self, record, datefmt=None):
+        second = int(record.created)
+        cached_second, cached_text = self._cached_time
+        if cached_second == second:
+            return cached_text
+
+        text = time.strftime(self.datefmt, self.converter(record.created))
+        self._cached_time = (second, text)
+        return text
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """只把日志记录放入队列，格式化和写入都由后台线程完成
+
+    默认的QueueHandler会在调用线程中先格式化再入队，同一进程内传递记录对象无需如此
+    """
+
+    def prepare(self, record):
+        return record
+
+class PeriodicFlushMemoryHandler(logging.handlers.MemoryHandler):
+    """除缓存满或遇到高级别日志外，后台线程每隔flush_interval秒也把缓存的记录写入目标处理器"""
+
+    def __init__(self, capacity, flushLevel, target, flush_interval=LOG_FLUSH_INTERVAL):
+        super().__init__(capacity, flushLevel=flushLevel, target=target)
+        self._closed_event = threading.Event()
+        threading.Thread(
+            target=self._flush_periodically,
+            args=(flush_interval,),
+            name="log-flush",
+            daemon=True
+        ).start()
+
+    def _flush_periodically(self, flush_interval):
+        while not self._closed_event.wait(flush_interval):
+            self.flush()
+
+    def close(self):
+        self._closed_event.set()
+        super().close()
+
+def setup_logging(log_file, name):
+    """配置根日志记录器并返回指定名称的logger
+
+    工作线程只把日志记录放入队列，由后台线程统一格式化并写入控制台和文件，不再争用处理器的锁。
+    文件日志先缓存在内存中批量写入，遇到ERROR及以上级别、缓存满或每隔LOG_FLUSH_INTERVAL秒刷新到磁盘，文件超过大小上限后轮转。
+    根日志记录器已有处理器时（脚本被其他脚本导入），沿用已有配置
+    """
+    root_logger = logging.getLogger()
+    if not root_logger.handlers:
+        formatter = CachedTimeFormatter()
+
+        stream_handler = logging.StreamHandler()
+        stream_handler.setFormatter(formatter)
+
+        file_handler = logging.handlers.RotatingFileHandler(
+            log_file,
+            maxBytes=LOG_MAX_BYTES,
+            backupCount=LOG_BACKUP_COUNT,
+            delay=True
+        )
+        file_handler.setFormatter(formatter)
+        buffered_file_handler = PeriodicFlushMemoryHandler(
+            capacity=1024,
+            flushLevel=logging.ERROR,
+            target=file_handler
+        )
+        atexit.register(buffered_file_handler.flush)
+
+        log_queue = queue.SimpleQueue()
+        listener = logging.handlers.QueueListener(log_queue, stream_handler, buffered_file_handler)
+        listener.start()
+        # 后注册的先执行：退出时先写完队列中剩余的记录，再刷新文件缓存
+        atexit.register(listener.stop)
+
+        root_logger.setLevel(logging.INFO)
+        root_logger.addHandler(DeferredQueueHandler(log_queue))
+
+    return logging.getLogger(name)
@@ -5,25 +5,17 @@ import os
 import sys
 import configparser
 import argparse
-import logging
-import tempfile
-import shutil
-import subprocess
+import atexit
+import json
+import heapq
+import math
+import threading
 import time
-from datetime import datetime
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from log_utils import setup_logging
 
 # 设置日志记录
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(),
-        logging.FileHandler("multi_accounts_backup.log")
-    ]
-)
-logger = logging.getLogger("multi_accounts_backup")
+logger = setup_logging("multi_accounts_backup.log", "multi_accounts_backup")
 
 def parse_arguments():
     """解析命令行参数"""
@@ -32,120 +24,167 @@ def parse_arguments():
     parser.add_argument('--parallel', type=int, default=3, help='并行备份的数据集数量，默认为3')
     parser.add_argument('--account', help='只备份指定账号的数据集，不指定则备份所有账号')
     parser.add_argument('--dataset', help='只备份指定数据集，不指定则备份账号下所有数据集')
+    parser.add_argument('--max-failures', type=int, help='失败的数据集超过该数量时取消尚未开始的备份，不指定则不限制')
     return parser.parse_args()
 
+# 进程内共用的线程池，首次使用时创建，进程退出时关闭
+_executor = None
+_executor_workers = 0
+_executor_lock = threading.Lock()
+
+def get_executor(max_workers):
+    """获取共用的线程池，只有请求的线程数与现有线程池不同时才重新创建
+
+    ThreadPoolExecutor按需启动工作线程，任务少于线程数时不会创建多余的线程
+    """
+    global _executor, _executor_workers
+    
+    with _executor_lock:
+        if _executor is None or _executor_workers != max_workers:
+            if _executor is not None:
+                _executor.shutdown(wait=False)
+            _executor = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="backup")
+            _executor_workers = max_workers
+        return _executor
+
+def _shutdown_executor():
+    """进程退出时等待线程池中的任务结束"""
+    if _executor is not None:
+        _executor.shutdown(wait=True)
+
+atexit.register(_shutdown_executor)
+
 def read_config(config_file):
-    """读取配置文件"""
+    """读取配置文件，文件不存在时返回None"""
     if not os.path.exists(config_file):
         logger.error(f"配置文件不存在: {config_file}")
-        sys.exit(1)
+        return None
         
     logger.info(f"读取配置文件: {config_file}")
-    config = configparser.ConfigParser()
+    # 配置中不使用%插值，关闭插值后读取选项时无需再做替换处理，token和密码中也可以包含%
+    config = configparser.ConfigParser(interpolation=None)
     config.read(config_file)
     
     return config
 
-def backup_dataset(hf_token, dataset_name, webdav_url, webdav_username, webdav_password, webdav_path, max_backups):
-    """备份单个数据集"""
-    logger.info(f"开始备份数据集: {dataset_name}")
+# 记录每个数据集上次备份耗时的缓存文件，用于安排任务顺序
+DURATION_CACHE_FILE = os.path.join(os.path.expanduser('~'), '.cache', 'qyl-hf-backup', 'durations.json')
+
+def load_durations():
+    """读取各数据集上次备份的耗时（秒），缓存不存在或无法读取时返回空字典"""
+    try:
+        with open(DURATION_CACHE_FILE, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_durations(durations):
+    """保存各数据集的备份耗时，先写临时文件再替换，避免中途退出留下损坏的缓存"""
+    try:
+        os.makedirs(os.path.dirname(DURATION_CACHE_FILE), exist_ok=True)
+        temp_file = DURATION_CACHE_FILE + '.tmp'
+        with open(temp_file, 'w', encoding='utf-8') as f:
+            json.dump(durations, f, ensure_ascii=False, indent=2)
+        os.replace(temp_file, DURATION_CACHE_FILE)
+    except OSError as e:
+        logger.warning(f"保存备份耗时缓存失败: {str(e)}")
+
+def backup_datasets(webdav_client, hf_token, dataset_names, webdav_path, max_backups, revisions=None):
+    """使用共用的WebDAV客户端备份同一账号、同一备份目录下的一批数据集，返回[(是否成功, 数据集, 错误信息, 耗时秒数)]"""
+    logger.info(f"开始备份数据集: {', '.join(dataset_names)}")
+    
+    import hf_dataset_backup
     
-    # 创建临时目录
-    with tempfile.TemporaryDirectory() as temp_dir:
+    batch_results = []
+    for dataset_name in dataset_names:
+        start_time = time.time()
         try:
-            # 构建备份命令
-            cmd = [
-                sys.executable, 
-                "hf_dataset_backup.py",
-                "--hf-token", hf_token,
-                "--dataset", dataset_name,
-                "--webdav-url", webdav_url,
-                "--webdav-username", webdav_username,
-                "--webdav-password", webdav_password,
-                "--webdav-path", webdav_path,
-                "--max-backups", str(max_backups)
-            ]
-            
-            # 执行备份命令
-            result = subprocess.run(cmd, capture_output=True, text=True, check=False)
-            
-            if result.returncode == 0:
-                logger.info(f"数据集 {dataset_name} 备份成功")
-                return True, dataset_name, None
-            else:
-                logger.error(f"数据集 {dataset_name} 备份失败: {result.stderr}")
-                return False, dataset_name, result.stderr
-        
+            _, success, error = hf_dataset_backup.run_batch(
+                webdav_client=webdav_client,
+                hf_token=hf_token,
+                datasets=[dataset_name],
+                webdav_path=webdav_path,
+                max_backups=max_backups,
+                revisions=revisions
+            )[0]
         except Exception as e:
-            logger.error(f"备份数据集 {dataset_name} 时发生错误: {str(e)}")
-            return False, dataset_name, str(e)
+            success, error = False, str(e)
+            
+        if success:
+            logger.info(f"数据集 {dataset_name} 备份成功")
+        else:
+            logger.error(f"数据集 {dataset_name} 备份失败: {error}")
+        batch_results.append((success, dataset_name, error, time.time() - start_time))
+    return batch_results
 
-def main():
-    # 解析命令行参数
-    args = parse_arguments()
-    
+def run(config_file='multi_accounts_config.ini', parallel=3, account=None, dataset=None, max_failures=None):
+    """执行多账号数据集备份，全部成功时返回True，供backup_all.py在进程内直接调用"""
     # 读取配置文件
-    config = read_config(args.config)
+    config = read_config(config_file)
+    if config is None:
+        return False
+        
+    # 一次性取出所有区段的选项，之后的查找都是普通字典操作，不再重复插值
+    sections = {name: dict(config.items(name)) for name in config.sections()}
     
     # 获取全局配置
+    global_section = sections['global']
     global_config = {
-        'webdav_url': config.get('global', 'webdav_url'),
-        'webdav_username': config.get('global', 'webdav_username'),
-        'webdav_password': config.get('global', 'webdav_password'),
-        'base_backup_path': config.get('global', 'base_backup_path'),
-        'max_backups': config.get('global', 'max_backups')
+        'webdav_url': global_section['webdav_url'],
+        'webdav_username': global_section['webdav_username'],
+        'webdav_password': global_section['webdav_password'],
+        'base_backup_path': global_section['base_backup_path'],
+        'max_backups': global_section['max_backups']
     }
     
     # 确保全局备份路径以/结尾
     if not global_config['base_backup_path'].endswith('/'):
         global_config['base_backup_path'] += '/'
     
-    # 收集所有要备份的账号和数据集
+    # 收集所有要备份的账号和数据集，同一账号下重复列出的数据集只备份一次
     backup_tasks = []
+    seen_tasks = set()
     
     # 遍历所有账号配置
-    for section in config.sections():
+    for section, account_config in sections.items():
         if not section.startswith('account:'):
             continue
             
         account_name = section.split(':', 1)[1]
         
         # 如果指定了账号，则只处理该账号
-        if args.account and args.account != account_name:
+        if account and account != account_name:
             continue
             
         # 获取账号配置
-        hf_token = config.get(section, 'hf_token')
+        hf_token = account_config['hf_token']
         
         # 获取该账号下的所有数据集
-        datasets_str = config.get(section, 'datasets')
+        datasets_str = account_config['datasets']
         datasets = [ds.strip() for ds in datasets_str.split(',')]
         
         # 如果指定了数据集，则只处理该数据集
-        if args.dataset:
-            datasets = [ds for ds in datasets if ds == args.dataset or ds.endswith('/' + args.dataset)]
+        if dataset:
+            datasets = [ds for ds in datasets if ds == dataset or ds.endswith('/' + dataset)]
             if not datasets:
                 continue
                 
         # 获取该账号的备份路径，如果没有设置则使用全局设置
-        if config.has_option(section, 'backup_path'):
-            backup_path = config.get(section, 'backup_path')
-            if not backup_path.endswith('/'):
-                backup_path += '/'
-        else:
-            backup_path = global_config['base_backup_path'] + account_name + '/'
+        backup_path = account_config.get('backup_path', global_config['base_backup_path'] + account_name + '/')
+        if not backup_path.endswith('/'):
+            backup_path += '/'
             
         # 获取该账号的最大备份数量，如果没有设置则使用全局设置
-        if config.has_option(section, 'max_backups'):
-            max_backups = config.get(section, 'max_backups')
-        else:
-            max_backups = global_config['max_backups']
+        max_backups = account_config.get('max_backups', global_config['max_backups'])
             
         # 将每个数据集的备份任务添加到列表中
-        for dataset in datasets:
+        for dataset_name in datasets:
+            if (account_name, dataset_name) in seen_tasks:
+                continue
+            seen_tasks.add((account_name, dataset_name))
             backup_tasks.append({
                 'account': account_name,
-                'dataset': dataset,
+                'dataset': dataset_name,
                 'hf_token': hf_token,
                 'webdav_url': global_config['webdav_url'],
                 'webdav_username': global_config['webdav_username'],
@@ -156,38 +195,128 @@ def main():
     
     if not backup_tasks:
         logger.warning("没有找到符合条件的备份任务")
-        return
+        return True
         
     logger.info(f"找到 {len(backup_tasks)} 个备份任务")
     
-    # 并行执行备份任务
-    successful = 0
-    failed = 0
+    # 在当前进程中直接调用，避免每个任务都启动新的解释器并重新导入依赖
+    import hf_dataset_backup
     
-    with ThreadPoolExecutor(max_workers=args.parallel) as executor:
-        futures = []
-        
-        for task in backup_tasks:
-            future = executor.submit(
-                backup_dataset,
-                task['hf_token'],
-                task['dataset'],
+    # 同一WebDAV服务器和用户的所有任务共用一个客户端（连接池和目录列表缓存）
+    webdav_clients = {}
+    for task in backup_tasks:
+        client_key = (task['webdav_url'], task['webdav_username'])
+        if client_key not in webdav_clients:
+            webdav_clients[client_key] = hf_dataset_backup.create_webdav_session(
                 task['webdav_url'],
                 task['webdav_username'],
-                task['webdav_password'],
-                task['webdav_path'],
-                task['max_backups']
+                task['webdav_password']
             )
-            futures.append(future)
             
-        for future in as_completed(futures):
-            success, dataset, error = future.result()
-            if success:
-                successful += 1
-            else:
-                failed += 1
+    # 使用进程内共用的线程池，多次调用时不重复创建和销毁工作线程
+    executor = get_executor(parallel)
+    
+    # 先并行查询所有数据集的修订版本，与最新备份一致的数据集不再提交备份任务
+    def check_task(task):
+        webdav_client = webdav_clients[(task['webdav_url'], task['webdav_username'])]
+        return hf_dataset_backup.check_dataset_changed(webdav_client, task['hf_token'], task['dataset'], task['webdav_path'])
+        
+    changed_tasks = []
+    for task, (changed, revision) in zip(backup_tasks, executor.map(check_task, backup_tasks)):
+        if changed:
+            task['revision'] = revision
+            changed_tasks.append(task)
+            
+    unchanged = len(backup_tasks) - len(changed_tasks)
+    if unchanged:
+        logger.info(f"{unchanged} 个数据集自上次备份后未变化，跳过备份")
+    backup_tasks = changed_tasks
+    
+    # 按上次备份耗时从长到短排列（最长处理时间优先），没有记录的数据集视为耗时最长
+    durations = load_durations()
+    
+    def expected_duration(task):
+        return durations.get(task['dataset'], float('inf'))
+        
+    backup_tasks.sort(key=expected_duration, reverse=True)
+    
+    # 同一令牌、同一备份目录的数据集分为一批，共用WebDAV客户端和远程目录列表
+    groups = {}
+    for task in backup_tasks:
+        key = (task['hf_token'], task['webdav_path'], task['max_backups'])
+        groups.setdefault(key, []).append(task)
+        
+    # 限制每批的大小，使批次数不少于并行数，避免分批降低并行度
+    batch_size = max(1, math.ceil(len(backup_tasks) / max(1, parallel)))
+    batches = []
+    for group in groups.values():
+        # 同一批内的数据集依次执行，按耗时从长到短把每个数据集分给当前预计总耗时最短的批次，
+        # 不把最长的几个数据集放进同一批；总耗时相同（包括都没有记录）时分给数据集较少的批次
+        group_batches = [[] for _ in range(math.ceil(len(group) / batch_size))]
+        totals = [(0, 0, index) for index in range(len(group_batches))]
+        for task in group:
+            total, count, index = heapq.heappop(totals)
+            group_batches[index].append(task)
+            heapq.heappush(totals, (total + expected_duration(task), count + 1, index))
+        batches.extend(group_batches)
+    batches.sort(key=lambda batch: sum(expected_duration(task) for task in batch), reverse=True)
+    
+    # 并行执行备份任务，未变化的数据集计为成功
+    successful = unchanged
+    failed = 0
+    futures = []
+    
+    # 提交任务前对每个不同的备份目录创建一次远程目录，工作线程中不再重复检查和创建
+    for client_key, webdav_path in sorted({((b[0]['webdav_url'], b[0]['webdav_username']), b[0]['webdav_path']) for b in batches}):
+        try:
+            webdav_clients[client_key].ensure_dir(webdav_path)
+        except Exception as e:
+            # 创建失败时由各个备份任务自行重试并记录错误
+            logger.warning(f"创建远程目录 {webdav_path} 时出错: {str(e)}")
+            
+    for batch in batches:
+        client_key = (batch[0]['webdav_url'], batch[0]['webdav_username'])
+        future = executor.submit(
+            backup_datasets,
+            webdav_clients[client_key],
+            batch[0]['hf_token'],
+            [task['dataset'] for task in batch],
+            batch[0]['webdav_path'],
+            batch[0]['max_backups'],
+            {task['dataset']: task['revision'] for task in batch}
+        )
+        futures.append(future)
+        
+    # 每完成一批就立即统计，失败过多（如WebDAV服务不可用）时不再等待其余批次
+    pending = set(futures)
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            for success, dataset_name, error, duration in future.result():
+                if success:
+                    successful += 1
+                    durations[dataset_name] = round(duration, 1)
+                else:
+                    failed += 1
+                    
+        if max_failures is not None and failed > max_failures and pending:
+            # 只能取消尚未开始的批次，正在执行的批次仍会等待其完成
+            cancelled = sum(1 for future in pending if future.cancel())
+            logger.error(f"失败数 {failed} 超过上限 {max_failures}，已取消 {cancelled} 批尚未开始的备份任务")
+            pending = {future for future in pending if not future.cancelled()}
+            max_failures = None
                 
+    save_durations(durations)
+    
     logger.info(f"所有备份任务完成。成功: {successful}, 失败: {failed}")
+    return failed == 0
+
+def main():
+    # 解析命令行参数
+    args = parse_arguments()
+    
+    if not run(args.config, args.parallel, args.account, args.dataset, args.max_failures):
+        sys.exit(1)
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
@@ -5,23 +5,13 @@ import os
 import sys
 import configparser
 import argparse
-import logging
-import subprocess
-import time
-from datetime import datetime
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from pathlib import Path
+import atexit
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from log_utils import setup_logging
 
 # 设置日志记录
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(),
-        logging.FileHandler("multi_db_backup.log")
-    ]
-)
-logger = logging.getLogger("multi_db_backup")
+logger = setup_logging("multi_db_backup.log", "multi_db_backup")
 
 def parse_arguments():
     """解析命令行参数"""
@@ -29,112 +19,92 @@ def parse_arguments():
     parser.add_argument('--config', default='db_config.ini', help='配置文件路径，默认为db_config.ini')
     parser.add_argument('--parallel', type=int, default=2, help='并行备份的数据库数量，默认为2')
     parser.add_argument('--database', help='只备份指定数据库，不指定则备份所有数据库')
+    parser.add_argument('--max-failures', type=int, help='失败的数据库超过该数量时取消尚未开始的备份，不指定则不限制')
     return parser.parse_args()
 
+# 进程内共用的线程池，首次使用时创建，进程退出时关闭
+_executor = None
+_executor_workers = 0
+_executor_lock = threading.Lock()
+
+def get_executor(max_workers):
+    """获取共用的线程池，只有请求的线程数与现有线程池不同时才重新创建
+
+    ThreadPoolExecutor按需启动工作线程，任务少于线程数时不会创建多余的线程
+    """
+    global _executor, _executor_workers
+    
+    with _executor_lock:
+        if _executor is None or _executor_workers != max_workers:
+            if _executor is not None:
+                _executor.shutdown(wait=False)
+            _executor = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="backup")
+            _executor_workers = max_workers
+        return _executor
+
+def _shutdown_executor():
+    """进程退出时等待线程池中的任务结束"""
+    if _executor is not None:
+        _executor.shutdown(wait=True)
+
+atexit.register(_shutdown_executor)
+
 def read_config(config_file):
-    """读取配置文件"""
+    """读取配置文件，文件不存在时返回None"""
     if not os.path.exists(config_file):
         logger.error(f"配置文件不存在: {config_file}")
-        sys.exit(1)
+        return None
         
     logger.info(f"读取配置文件: {config_file}")
-    config = configparser.ConfigParser()
+    # 配置中不使用%插值，关闭插值后读取选项时无需再做替换处理，密码中也可以包含%
+    config = configparser.ConfigParser(interpolation=None)
     config.read(config_file)
     
     return config
 
-def backup_database(db_config, global_config):
-    """备份单个数据库"""
+def backup_database(webdav_client, db_config, global_config):
+    """使用共用的WebDAV客户端备份单个数据库"""
     db_name = db_config.get('name')
     db_type = db_config.get('type')
     logger.info(f"开始备份数据库: {db_name} (类型: {db_type})")
     
-    # 构建备份命令
-    cmd = [
-        sys.executable, 
-        "db_backup.py",
-        f"--db-type={db_type}",
-        f"--db-name={db_name}",
-        f"--webdav-url={global_config['webdav_url']}",
-        f"--webdav-username={global_config['webdav_username']}",
-        f"--webdav-password={global_config['webdav_password']}",
-    ]
-    
-    # 添加数据库特定参数
-    if 'user' in db_config:
-        cmd.append(f"--db-user={db_config['user']}")
-        
-    if 'password' in db_config:
-        cmd.append(f"--db-password={db_config['password']}")
-        
-    if 'host' in db_config:
-        cmd.append(f"--db-host={db_config['host']}")
-        
-    if 'port' in db_config:
-        cmd.append(f"--db-port={db_config['port']}")
-        
-    if 'file' in db_config:
-        cmd.append(f"--db-file={db_config['file']}")
-        
-    if 'custom_cmd' in db_config:
-        cmd.append(f"--custom-cmd={db_config['custom_cmd']}")
-    
     # 确定WebDAV路径
-    if 'backup_path' in db_config:
-        webdav_path = db_config['backup_path']
-    else:
-        webdav_path = os.path.join(global_config['base_backup_path'], db_type)
+    webdav_path = db_config.get('backup_path', os.path.join(global_config['base_backup_path'], db_type))
         
-    cmd.append(f"--webdav-path={webdav_path}")
-    
     # 设置最大备份数量
-    if 'max_backups' in db_config:
-        max_backups = db_config['max_backups']
-    else:
-        max_backups = global_config['max_backups']
-        
-    cmd.append(f"--max-backups={max_backups}")
+    max_backups = db_config.get('max_backups', global_config['max_backups'])
     
-    # 执行备份命令
+    # 执行备份
     try:
-        logger.info(f"执行备份命令: {' '.join(cmd)}")
-        result = subprocess.run(cmd, capture_output=True, text=True, check=False)
+        import db_backup
         
-        if result.returncode == 0:
+        success, error = db_backup.run_with_client(
+            webdav_client=webdav_client,
+            db_type=db_type,
+            db_name=db_name,
+            webdav_path=webdav_path,
+            max_backups=max_backups,
+            db_user=db_config.get('user'),
+            db_password=db_config.get('password'),
+            db_host=db_config.get('host'),
+            db_port=db_config.get('port'),
+            db_file=db_config.get('file'),
+            custom_cmd=db_config.get('custom_cmd')
+        )
+        
+        if success:
             logger.info(f"数据库 {db_name} 备份成功")
             return True, db_name, None
         else:
-            logger.error(f"数据库 {db_name} 备份失败: {result.stderr}")
-            return False, db_name, result.stderr
+            logger.error(f"数据库 {db_name} 备份失败: {error}")
+            return False, db_name, error
             
     except Exception as e:
         logger.error(f"备份数据库 {db_name} 时发生错误: {str(e)}")
         return False, db_name, str(e)
 
-def main():
-    # 解析命令行参数
-    args = parse_arguments()
-    
-    # 读取配置文件
-    config = read_config(args.config)
-    
-    # 获取全局配置
-    global_config = {
-        'webdav_url': config.get('global', 'webdav_url'),
-        'webdav_username': config.get('global', 'webdav_username'),
-        'webdav_password': config.get('global', 'webdav_password'),
-        'base_backup_path': config.get('global', 'base_backup_path'),
-        'max_backups': config.get('global', 'max_backups')
-    }
-    
-    # 确保全局备份路径以/结尾
-    if not global_config['base_backup_path'].endswith('/'):
-        global_config['base_backup_path'] += '/'
-    
-    # 收集所有要备份的数据库
-    backup_tasks = []
-    
-    # 遍历所有数据库配置
+def iter_backup_tasks(config, database=None):
+    """逐个区段生成数据库配置，调用方可以边解析边提交备份任务"""
     for section in config.sections():
         if not section.startswith('database:'):
             continue
@@ -142,51 +112,100 @@ def main():
         database_name = section.split(':', 1)[1]
         
         # 如果指定了数据库，则只处理该数据库
-        if args.database and args.database != database_name:
+        if database and database != database_name:
             continue
             
-        # 获取数据库配置
+        # 获取数据库配置，一次性取出该区段的所有选项
         db_config = dict(config.items(section))
         
         # 添加数据库名称到配置中
         if 'name' not in db_config:
             db_config['name'] = database_name
             
-        # 将数据库备份任务添加到列表中
-        backup_tasks.append({
-            'db_config': db_config,
-            'global_config': global_config
-        })
+        yield db_config
+
+def run(config_file='db_config.ini', parallel=2, database=None, max_failures=None):
+    """执行多数据库备份，全部成功时返回True，供backup_all.py在进程内直接调用"""
+    # 读取配置文件
+    config = read_config(config_file)
+    if config is None:
+        return False
+        
+    # 获取全局配置
+    global_section = dict(config.items('global'))
+    global_config = {
+        'webdav_url': global_section['webdav_url'],
+        'webdav_username': global_section['webdav_username'],
+        'webdav_password': global_section['webdav_password'],
+        'base_backup_path': global_section['base_backup_path'],
+        'max_backups': global_section['max_backups']
+    }
+    
+    # 确保全局备份路径以/结尾
+    if not global_config['base_backup_path'].endswith('/'):
+        global_config['base_backup_path'] += '/'
     
-    if not backup_tasks:
+    # 在当前进程中直接调用，避免每个任务都启动新的解释器并重新导入依赖
+    import db_backup
+    
+    # 所有数据库使用同一WebDAV服务器和用户，共用一个客户端（连接池和目录列表缓存）
+    webdav_client = db_backup.create_webdav_session(
+        global_config['webdav_url'],
+        global_config['webdav_username'],
+        global_config['webdav_password']
+    )
+    
+    # 使用进程内共用的线程池，多次调用时不重复创建和销毁工作线程
+    executor = get_executor(parallel)
+    futures = []
+    
+    # 每解析出一个数据库配置就立即提交，第一个备份不必等待整个配置处理完
+    for db_config in iter_backup_tasks(config, database):
+        future = executor.submit(
+            backup_database,
+            webdav_client,
+            db_config,
+            global_config
+        )
+        futures.append(future)
+    
+    if not futures:
         logger.warning("没有找到符合条件的数据库备份任务")
-        return
+        return True
         
-    logger.info(f"找到 {len(backup_tasks)} 个数据库备份任务")
+    logger.info(f"找到 {len(futures)} 个数据库备份任务")
     
     # 并行执行备份任务
     successful = 0
     failed = 0
     
-    with ThreadPoolExecutor(max_workers=args.parallel) as executor:
-        futures = []
-        
-        for task in backup_tasks:
-            future = executor.submit(
-                backup_database,
-                task['db_config'],
-                task['global_config']
-            )
-            futures.append(future)
-            
-        for future in as_completed(futures):
-            success, database, error = future.result()
+    # 每完成一个任务就立即统计，失败过多（如WebDAV服务不可用）时不再等待其余任务
+    pending = set(futures)
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            success, _, error = future.result()
             if success:
                 successful += 1
             else:
                 failed += 1
                 
+        if max_failures is not None and failed > max_failures and pending:
+            # 只能取消尚未开始的任务，正在执行的任务仍会等待其完成
+            cancelled = sum(1 for future in pending if future.cancel())
+            logger.error(f"失败数 {failed} 超过上限 {max_failures}，已取消 {cancelled} 个尚未开始的备份任务")
+            pending = {future for future in pending if not future.cancelled()}
+            max_failures = None
+            
     logger.info(f"所有数据库备份任务完成。成功: {successful}, 失败: {failed}")
+    return failed == 0
+
+def main():
+    # 解析命令行参数
+    args = parse_arguments()
+    
+    if not run(args.config, args.parallel, args.database, args.max_failures):
+        sys.exit(1)
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
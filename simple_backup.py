@@ -4,29 +4,86 @@
 import os
 import sys
 import argparse
-import logging
+import functools
+import heapq
+import itertools
+import re
 import tempfile
 import shutil
+import stat
+import threading
 import time
 import tarfile
+import gzip
 from datetime import datetime
+from collections import deque
 from concurrent.futures import ThreadPoolExecutor, as_completed
 import configparser
 import subprocess
+import importlib.util
 from pathlib import Path
-from huggingface_hub import snapshot_download, HfApi
+
+# 安装了hf_transfer时启用其并行分段下载（单个大压缩包也能多线程下载），必须在导入huggingface_hub之前设置
+# 未安装时不能设置该变量，否则huggingface_hub下载时会报错
+if importlib.util.find_spec('hf_transfer') is not None:
+    os.environ.setdefault('HF_HUB_ENABLE_HF_TRANSFER', '1')
+
+# 使用xet存储的仓库由hf_xet以高性能模式下载，未安装hf_xet时该变量不起作用
+os.environ.setdefault('HF_XET_HIGH_PERFORMANCE', '1')
+
+from huggingface_hub import HfApi
 import webdav3.client as wc
+from webdav_utils import WebdavSession, UploadNotStartedError, upload_from_writer, set_http_pool_size, UPLOAD_CHUNK_SIZE, WEBDAV_TIMEOUT
+from log_utils import setup_logging
+
+try:
+    import sqlite3
+except ImportError:
+    # 部分精简编译的Python不带sqlite3模块，此时直接复制数据库文件
+    sqlite3 = None
 
 # 设置日志记录
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(),
-        logging.FileHandler("backup.log")
-    ]
+logger = setup_logging("backup.log", "backup")
+
+# 下载整个数据集时默认并行下载的文件数，项目配置中的dl_workers可以覆盖
+HF_DOWNLOAD_WORKERS = min(16, (os.cpu_count() or 1) * 4)
+
+# 已确定的项目存储库类型，同一进程内再次备份同一项目时不再逐个尝试
+_resolved_repo_types = {}
+
+# 项目备份文件和数据库备份文件的扩展名，str.endswith可以直接接受元组
+ARCHIVE_EXTENSIONS = ('.zip', '.tar.gz', '.7z')
+DB_BACKUP_EXTENSIONS = ('.sql', '.sql.gz', '.dump', '.archive.gz', '.zip', '.db')
+
+# 备份文件名中保存的修订版本SHA长度
+REVISION_LENGTH = 12
+
+# 从已下载的压缩文件名中提取前缀，支持 prefix_backup_timestamp.ext 和 prefix_timestamp.ext 两种格式
+ARCHIVE_PREFIX_PATTERN = re.compile(
+    rf'^(?P<prefix>.+?)_(?:backup_)?\d{{8}}_\d{{6}}(?:_[0-9a-f]{{{REVISION_LENGTH}}})?\.(?:tar\.gz|zip|7z)$'
 )
-logger = logging.getLogger("backup")
+
+# SQLite在线备份每一步复制的页数
+SQLITE_BACKUP_PAGES = 1024
+
+# 系统中安装了pigz时使用其多线程gzip压缩，否则使用gzip模块单线程压缩
+PIGZ_PATH = shutil.which('pigz')
+
+# 并行读取文件、生成tar记录的线程数
+TAR_WORKERS = os.cpu_count() or 1
+
+# 项目压缩包的gzip压缩级别，与pigz和gzip命令的默认级别相同；gzip模块默认使用最高级别9，耗时数倍而体积几乎不变
+ARCHIVE_COMPRESSLEVEL = 6
+
+# 这些格式的文件本身已经压缩，再用gzip压缩几乎不能减小体积；大部分文件为这些格式时使用最快的压缩级别
+COMPRESSED_EXTENSIONS = (
+    '.parquet', '.safetensors', '.gz', '.tgz', '.zip', '.7z', '.bz2', '.xz', '.zst',
+    '.png', '.jpg', '.jpeg', '.webp', '.gif', '.mp3', '.mp4', '.ogg', '.flac', '.webm'
+)
+FAST_COMPRESSLEVEL = 1
+
+# 不超过该大小的文件由工作线程整体读入内存生成tar记录，更大的文件由写入线程直接按块复制
+TAR_INLINE_SIZE = UPLOAD_CHUNK_SIZE
 
 def parse_arguments():
     """解析命令行参数"""
@@ -44,7 +101,8 @@ def read_config(config_file):
         sys.exit(1)
         
     logger.info(f"读取配置文件: {config_file}")
-    config = configparser.ConfigParser()
+    # 配置中不使用%插值，关闭后密码等配置项也可以包含%
+    config = configparser.ConfigParser(interpolation=None)
     config.read(config_file)
     
     return config
@@ -55,102 +113,270 @@ def setup_webdav_client(url, username, password):
         'webdav_hostname': url,
         'webdav_login': username,
         'webdav_password': password,
-        'webdav_timeout': 300  # 5分钟超时
+        'webdav_timeout': WEBDAV_TIMEOUT
     }
-    return wc.Client(options)
+    return WebdavSession(wc.Client(options))
+
+@functools.lru_cache(maxsize=None)
+def get_hf_api(hf_token):
+    """同一令牌的所有项目共用一个HuggingFace API对象"""
+    return HfApi(token=hf_token)
+
+def get_repo_info(dataset_name, hf_token, repo_type=None):
+    """确定存储库类型并获取存储库信息，返回(存储库类型, 存储库信息, 文件列表)，所有类型都无法访问时抛出异常"""
+    # 获取该令牌共用的HuggingFace API对象
+    api = get_hf_api(hf_token)
+    
+    # 如果指定了存储库类型，则直接使用
+    if repo_type:
+        logger.info(f"使用配置的存储库类型: {repo_type}")
+        repo_types = [repo_type]
+    elif dataset_name in _resolved_repo_types:
+        repo_types = [_resolved_repo_types[dataset_name]]
+    else:
+        # 否则尝试不同的存储库类型
+        logger.info("未指定存储库类型，将尝试多种类型")
+        repo_types = ["dataset", "model", "space"]
+        
+    for rt in repo_types:
+        try:
+            logger.info(f"尝试以 {rt} 类型访问存储库: {dataset_name}")
+            # 一次请求获取存储库信息，其中已包含文件列表，无需再单独列出文件
+            info = api.repo_info(dataset_name, repo_type=rt, token=hf_token)
+            if info.siblings is not None:
+                files = [sibling.rfilename for sibling in info.siblings]
+            else:
+                files = api.list_repo_files(dataset_name, repo_type=rt)
+            _resolved_repo_types[dataset_name] = rt
+            logger.info(f"成功以 {rt} 类型访问存储库")
+            return rt, info, files
+        except Exception as e:
+            logger.warning(f"无法以 {rt} 类型访问: {str(e)}")
+            continue
+            
+    raise Exception(f"无法访问存储库 {dataset_name}，尝试了所有支持的类型")
 
-def download_dataset(dataset_name, hf_token, temp_dir, repo_type=None):
-    """从HuggingFace下载数据集"""
+def download_dataset(dataset_name, hf_token, repo):
+    """下载存储库中最新的压缩包到本地缓存并返回缓存中的路径，repo为get_repo_info已获取的存储库信息
+
+    直接使用huggingface_hub缓存中的文件，不再复制到临时目录；未变化的文件在下次运行时也无需重新下载
+    """
     logger.info(f"开始下载数据集: {dataset_name}")
     
     try:
-        # 创建HuggingFace API对象
-        api = HfApi(token=hf_token)
-        
-        # 如果指定了存储库类型，则直接使用
-        if repo_type:
-            logger.info(f"使用配置的存储库类型: {repo_type}")
-            repo_types = [repo_type]
-        else:
-            # 否则尝试不同的存储库类型
-            logger.info("未指定存储库类型，将尝试多种类型")
-            repo_types = ["dataset", "model", "space"]
-            
-        success = False
-        
-        for rt in repo_types:
-            try:
-                logger.info(f"尝试以 {rt} 类型访问存储库: {dataset_name}")
-                # 尝试列出存储库文件
-                files = api.list_repo_files(dataset_name, repo_type=rt)
-                success = True
-                repo_type = rt  # 保存成功的类型
-                logger.info(f"成功以 {rt} 类型访问存储库")
-                break
-            except Exception as e:
-                logger.warning(f"无法以 {rt} 类型访问: {str(e)}")
-                continue
-                
-        if not success:
-            raise Exception(f"无法访问存储库 {dataset_name}，尝试了所有支持的类型")
-        
-        # 查找可能的备份文件（压缩包）
-        backup_files = [f for f in files if f.endswith('.zip') or f.endswith('.tar.gz') or f.endswith('.7z')]
+        # 获取该令牌共用的HuggingFace API对象
+        api = get_hf_api(hf_token)
+        repo_type, _, files = repo
+        
+        # 排序获取最新的备份文件（压缩包）
+        backup_files = sorted((f for f in files if f.endswith(ARCHIVE_EXTENSIONS)), reverse=True)
+        latest_backup = backup_files[0]
+        logger.info(f"发现{len(backup_files)}个备份文件，将下载最新的: {latest_backup}")
+        
+        # 下载最新的备份文件
+        file_path = api.hf_hub_download(
+            repo_id=dataset_name,
+            filename=latest_backup,
+            repo_type=repo_type,
+            token=hf_token
+        )
         
-        if backup_files:
-            # 排序获取最新的备份文件
-            backup_files.sort(reverse=True)
-            latest_backup = backup_files[0]
-            logger.info(f"发现{len(backup_files)}个备份文件，将下载最新的: {latest_backup}")
-            
-            # 下载最新的备份文件
-            file_path = os.path.join(temp_dir, latest_backup)
-            api.hf_hub_download(
-                repo_id=dataset_name,
-                filename=latest_backup,
-                local_dir=temp_dir,
-                local_dir_use_symlinks=False,
-                repo_type=repo_type,
-                token=hf_token
-            )
-            
-            logger.info(f"最新备份文件下载完成: {file_path}")
-            return file_path
-        else:
-            # 如果没有发现备份文件，下载整个数据集
-            logger.info(f"未发现备份文件，将下载整个数据集")
-            snapshot_path = snapshot_download(
-                repo_id=dataset_name,
-                repo_type=repo_type,
-                token=hf_token,
-                local_dir=temp_dir,
-                local_dir_use_symlinks=False
-            )
-            logger.info(f"数据集下载完成: {snapshot_path}")
-            return snapshot_path
+        logger.info(f"最新备份文件下载完成: {file_path}")
+        return file_path
     
     except Exception as e:
         logger.error(f"下载数据集时出错: {str(e)}")
         return None
 
-def create_archive(source_dir, file_prefix):
-    """创建数据集的压缩文件"""
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    archive_name = f"{file_prefix}_backup_{timestamp}.tar.gz"
-    archive_path = os.path.join(tempfile.gettempdir(), archive_name)
+def build_tar_record(path, name):
+    """生成一个tar记录，返回(已生成的字节, 需要由写入线程复制内容的大文件路径或None, 文件大小)"""
+    st = os.stat(path)
+    info = tarfile.TarInfo(name)
+    info.mode = st.st_mode & 0o7777
+    info.uid = st.st_uid
+    info.gid = st.st_gid
+    info.mtime = st.st_mtime
+    
+    # 用同一次stat的结果判断是否为目录，每个条目只需一次系统调用
+    if stat.S_ISDIR(st.st_mode):
+        info.type = tarfile.DIRTYPE
+        return info.tobuf(tarfile.DEFAULT_FORMAT, 'utf-8', 'surrogateescape'), None, 0
+        
+    info.size = st.st_size
+    header = info.tobuf(tarfile.DEFAULT_FORMAT, 'utf-8', 'surrogateescape')
+    if info.size > TAR_INLINE_SIZE:
+        return header, path, info.size
+        
+    with open(path, 'rb') as f:
+        data = f.read()
+    if len(data) != info.size:
+        raise IOError(f"文件在打包过程中发生变化: {path}")
+    padding = tarfile.BLOCKSIZE - len(data) % tarfile.BLOCKSIZE
+    return header + data + (tarfile.NUL * padding if padding < tarfile.BLOCKSIZE else b''), None, info.size
+
+def copy_file_record(path, size, output):
+    """按块复制大文件内容并补齐到tar块大小"""
+    remaining = size
+    with open(path, 'rb', buffering=0) as f:
+        while remaining:
+            chunk = f.read(min(remaining, UPLOAD_CHUNK_SIZE))
+            if not chunk:
+                raise IOError(f"文件在打包过程中发生变化: {path}")
+            output.write(chunk)
+            remaining -= len(chunk)
+    padding = tarfile.BLOCKSIZE - size % tarfile.BLOCKSIZE
+    if padding < tarfile.BLOCKSIZE:
+        output.write(tarfile.NUL * padding)
+
+def repo_archive_entries(files, root_name):
+    """按打包顺序返回存储库文件的(仓库内文件名, 包内名称)列表，目录在其内容之前，目录项的文件名为None"""
+    entries = [(None, root_name)]
+    known_dirs = set()
+    
+    for filename in sorted(files):
+        parts = filename.split('/')
+        for depth in range(1, len(parts)):
+            dir_name = '/'.join(parts[:depth])
+            if dir_name not in known_dirs:
+                known_dirs.add(dir_name)
+                entries.append((None, f"{root_name}/{dir_name}"))
+        entries.append((filename, f"{root_name}/{filename}"))
+        
+    return entries
+
+def build_repo_tar_record(repo_id, hf_token, repo_type, revision, filename, name):
+    """下载存储库中的一个文件到huggingface_hub缓存并生成其tar记录，filename为None时生成目录记录"""
+    if filename is None:
+        info = tarfile.TarInfo(name)
+        info.type = tarfile.DIRTYPE
+        info.mode = 0o755
+        info.mtime = time.time()
+        return info.tobuf(tarfile.DEFAULT_FORMAT, 'utf-8', 'surrogateescape'), None, 0
+        
+    # 固定修订版本，使包内文件与备份文件名中记录的版本一致
+    path = get_hf_api(hf_token).hf_hub_download(
+        repo_id=repo_id,
+        filename=filename,
+        repo_type=repo_type,
+        revision=revision,
+        token=hf_token
+    )
+    return build_tar_record(path, name)
+
+def write_tar_stream(output, entries, build_record=build_tar_record, workers=TAR_WORKERS):
+    """将entries中的(来源, 包内名称)打包为未压缩的tar流写入output，build_record(来源, 包内名称)生成每个tar记录
+
+    多个工作线程并行生成tar记录，当前线程按顺序写出；最多提前准备workers*2个记录以限制内存占用
+    """
+    written = 0
+    
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="tar-worker") as executor:
+        pending = deque()
+        entry_iter = iter(entries)
+        try:
+            for source, name in itertools.islice(entry_iter, workers * 2):
+                pending.append(executor.submit(build_record, source, name))
+            while pending:
+                data, large_path, size = pending.popleft().result()
+                next_entry = next(entry_iter, None)
+                if next_entry is not None:
+                    pending.append(executor.submit(build_record, *next_entry))
+                output.write(data)
+                written += len(data)
+                if large_path is not None:
+                    copy_file_record(large_path, size, output)
+                    written += -(-size // tarfile.BLOCKSIZE) * tarfile.BLOCKSIZE
+        finally:
+            for future in pending:
+                future.cancel()
+                
+    # 结尾写入两个空块，并像tarfile一样补齐到完整的记录大小
+    end_blocks = tarfile.NUL * (tarfile.BLOCKSIZE * 2)
+    written += len(end_blocks)
+    remainder = written % tarfile.RECORDSIZE
+    output.write(end_blocks + (tarfile.NUL * (tarfile.RECORDSIZE - remainder) if remainder else b''))
+
+def archive_compresslevel(filenames):
+    """根据文件名选择压缩级别，超过一半的文件为已压缩的格式时使用最快的级别"""
+    filenames = list(filenames)
+    compressed_count = sum(1 for name in filenames if name.lower().endswith(COMPRESSED_EXTENSIONS))
+    if compressed_count * 2 > len(filenames):
+        return FAST_COMPRESSLEVEL
+    return ARCHIVE_COMPRESSLEVEL
+
+def write_tar_gz(fileobj, write_tar, compresslevel=ARCHIVE_COMPRESSLEVEL):
+    """将write_tar(output)生成的tar流压缩为tar.gz顺序写入fileobj，有pigz时由pigz在多个CPU核心上并行压缩"""
+    if PIGZ_PATH is None:
+        with gzip.GzipFile(fileobj=fileobj, mode='wb', compresslevel=compresslevel) as output:
+            write_tar(output)
+        return
+        
+    # 打包生成的未压缩tar流写入pigz，压缩结果由单独的线程读出并写入fileobj
+    process = subprocess.Popen(
+        [PIGZ_PATH, f'-{compresslevel}', '-p', str(os.cpu_count() or 1), '-c'],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        close_fds=False
+    )
+    read_errors = []
     
-    logger.info(f"正在创建压缩文件: {archive_path}")
+    def copy_output():
+        try:
+            shutil.copyfileobj(process.stdout, fileobj, UPLOAD_CHUNK_SIZE)
+        except BaseException as e:
+            read_errors.append(e)
+            # 写入端出错（如上传中止）时结束pigz，打包线程不会一直阻塞在写管道上
+            process.kill()
+            
+    reader = threading.Thread(target=copy_output, name="pigz-reader", daemon=True)
+    reader.start()
     
     try:
-        # 创建压缩文件
-        with tarfile.open(archive_path, "w:gz") as tar:
-            tar.add(source_dir, arcname=os.path.basename(source_dir))
-            
-        logger.info(f"压缩文件创建成功: {archive_path}")
-        return archive_path
+        write_tar(process.stdin)
+    finally:
+        # 关闭pigz的标准输入，使其写完剩余的压缩数据后退出
+        try:
+            process.stdin.close()
+        except OSError:
+            pass
+        reader.join()
+        process.stdout.close()
+        process.wait()
+        
+    if read_errors:
+        raise read_errors[0]
+    if process.returncode != 0:
+        raise IOError(f"pigz压缩失败，返回码: {process.returncode}")
+
+def backup_timestamp():
+    """返回备份文件名中使用的时间戳"""
+    return datetime.now().strftime("%Y%m%d_%H%M%S")
+
+def stream_archive_to_webdav(webdav_client, write_tar, file_prefix, remote_path, revision=None,
+                             compresslevel=ARCHIVE_COMPRESSLEVEL, timestamp=None):
+    """将write_tar(output)生成的tar流压缩为tar.gz并直接流式上传到WebDAV，压缩与上传同时进行，压缩包不在本地落盘
+
+    提供修订版本时将其短SHA写入文件名，下次备份时据此判断项目是否有变化
+    """
+    timestamp = timestamp or backup_timestamp()
+    if revision:
+        archive_name = f"{file_prefix}_backup_{timestamp}_{revision[:REVISION_LENGTH]}.tar.gz"
+    else:
+        archive_name = f"{file_prefix}_backup_{timestamp}.tar.gz"
+    remote_file_path = remote_path + archive_name
+    
+    logger.info(f"正在创建压缩文件并流式上传到WebDAV: {remote_file_path}")
+    
+    try:
+        # 递归创建远程目录
+        create_remote_dirs(webdav_client, remote_path)
+        
+        upload_from_writer(webdav_client, remote_file_path, lambda writer: write_tar_gz(writer, write_tar, compresslevel))
+        logger.info(f"文件上传成功: {remote_file_path}")
+        return remote_file_path
     except Exception as e:
-        logger.error(f"创建压缩文件时出错: {str(e)}")
-        return None
+        logger.error(f"创建并上传压缩文件时出错: {str(e)}")
+        raise
 
 def upload_to_webdav(webdav_client, local_file, remote_path):
     """上传文件到WebDAV服务器"""
@@ -174,28 +400,39 @@ def upload_to_webdav(webdav_client, local_file, remote_path):
         raise
 
 def create_remote_dirs(webdav_client, path):
-    """递归创建远程目录"""
+    """递归创建远程目录
+
+    从最深一级向上查找已存在的目录，目录已存在时只需一次请求；已确认的目录记录在客户端中，同一次备份不再重复请求
+    """
     if path == "/" or path == "":
         return
         
-    # 去掉末尾的斜杠以便处理
-    if path.endswith('/'):
-        path = path[:-1]
-        
-    parent_path = os.path.dirname(path)
-    
-    # 确保父目录存在
-    if parent_path and parent_path != "/":
-        create_remote_dirs(webdav_client, parent_path + "/")
+    try:
+        webdav_client.ensure_dir(path)
+    except Exception as e:
+        # 如果目录已存在，忽略错误
+        logger.debug("创建目录时发生错误(可能已存在): %s", e)
+
+def latest_backup_revision(webdav_client, remote_path, file_prefix):
+    """从远程目录中最新备份的文件名读取其修订版本短SHA，没有可用信息时返回None"""
+    backup_prefix = f"{file_prefix}_backup_"
+    pattern = re.compile(rf'^{re.escape(backup_prefix)}\d{{8}}_\d{{6}}_([0-9a-f]{{{REVISION_LENGTH}}})\.tar\.gz$')
     
-    # 创建当前目录
-    if not webdav_client.check(path + "/"):
-        try:
-            logger.info(f"创建远程目录: {path}/")
-            webdav_client.mkdir(path + "/")
-        except Exception as e:
-            # 如果目录已存在，忽略错误
-            logger.debug(f"创建目录时发生错误(可能已存在): {str(e)}")
+    try:
+        files = webdav_client.list(remote_path)
+    except Exception as e:
+        logger.info(f"无法列出远程目录 {remote_path}: {str(e)}")
+        return None
+        
+    backup_files = sorted(f for f in files if f.startswith(backup_prefix) and f.endswith('.tar.gz'))
+    if not backup_files:
+        return None
+        
+    match = pattern.match(backup_files[-1])
+    return match.group(1) if match else None
+
+# 清理旧备份时并行删除的最大请求数
+CLEANUP_WORKERS = 8
 
 def cleanup_old_backups(webdav_client, remote_path, name, max_backups, is_db=False, is_project=False):
     """清理旧的备份文件，只保留指定数量的最新备份"""
@@ -205,7 +442,8 @@ def cleanup_old_backups(webdav_client, remote_path, name, max_backups, is_db=Fal
     try:
         # 列出远程目录中的所有文件
         files = webdav_client.list(remote_path)
-        logger.info(f"远程目录 {remote_path} 中的所有文件: {files}")
+        # 目录中的文件可能很多，完整列表只在调试级别输出，未启用时不格式化
+        logger.debug("远程目录 %s 中的所有文件: %s", remote_path, files)
         
         # 为了处理各种情况，我们允许多个可能的前缀
         possible_prefixes = [prefix]
@@ -216,58 +454,67 @@ def cleanup_old_backups(webdav_client, remote_path, name, max_backups, is_db=Fal
         elif prefix == "sillytavern":
             possible_prefixes.append("sjg")
             
-        # 过滤出与当前项目/数据库相关的备份文件
+        # 过滤出与当前项目/数据库相关的备份文件，所有前缀一次匹配，集合去除重复项
         if is_db:
             # 数据库备份文件可能有多种格式
-            backup_files = []
-            for p in possible_prefixes:
-                backup_files.extend([f for f in files if f.startswith(p) and 
-                           (f.endswith('.sql') or f.endswith('.dump') or 
-                            f.endswith('.zip') or f.endswith('.db'))])
-        else:
-            # 项目备份文件
-            backup_files = []
+            prefixes = tuple(possible_prefixes)
+            extensions = DB_BACKUP_EXTENSIONS
+        elif is_project:
             # 如果是项目备份并且我们知道确切的前缀，就使用更严格的匹配
-            if is_project:
-                for p in possible_prefixes:
-                    backup_files.extend([f for f in files if 
-                               (f.startswith(f"{p}_backup_") or  # 标准格式 prefix_backup_timestamp.ext
-                                f.startswith(f"{p}_20"))  # 备用格式 prefix_timestamp.ext
-                               and (f.endswith('.zip') or f.endswith('.tar.gz') or f.endswith('.7z'))])
-            else:
-                # 旧的简单匹配方式，仅作为后备
-                for p in possible_prefixes:
-                    backup_files.extend([f for f in files if f.startswith(p) and 
-                               (f.endswith('.zip') or f.endswith('.tar.gz') or f.endswith('.7z'))])
-        
-        # 删除重复项
-        backup_files = list(set(backup_files))
+            # 标准格式 prefix_backup_timestamp.ext，备用格式 prefix_timestamp.ext
+            prefixes = tuple(f"{p}{suffix}" for p in possible_prefixes for suffix in ("_backup_", "_20"))
+            extensions = ARCHIVE_EXTENSIONS
+        else:
+            # 旧的简单匹配方式，仅作为后备
+            prefixes = tuple(possible_prefixes)
+            extensions = ARCHIVE_EXTENSIONS
+            
+        backup_files = list({f for f in files if f.startswith(prefixes) and f.endswith(extensions)})
         
-        logger.info(f"远程目录中找到 {len(backup_files)} 个备份文件: {backup_files}")
+        logger.info(f"远程目录中找到 {len(backup_files)} 个备份文件")
+        logger.debug("备份文件: %s", backup_files)
         
         if len(backup_files) <= max_backups:
             logger.info(f"备份文件数量未超过限制({len(backup_files)}/{max_backups})，无需清理")
             return
             
-        # 按文件名排序（包含时间戳，所以旧文件会排在前面）
-        backup_files.sort()
-        
         # 确定需要删除的文件数量
         files_to_delete = len(backup_files) - max_backups
         
-        # 删除旧文件
-        for i in range(files_to_delete):
-            file_to_delete = remote_path + backup_files[i]
+        # 按服务器记录的修改时间找出要保留的最新文件，不同前缀、不同命名格式的备份也能正确排序；
+        # 服务器未提供所有文件的修改时间时按文件名排序（文件名包含时间戳，新文件排在后面）。
+        # 保留的数量通常远小于文件总数，只选出要保留的文件，其余全部删除
+        modified_times = webdav_client.modified_times(remote_path)
+        if all(f in modified_times for f in backup_files):
+            files_to_keep = set(heapq.nlargest(max_backups, backup_files, key=lambda f: (modified_times[f], f)))
+        else:
+            files_to_keep = set(heapq.nlargest(max_backups, backup_files))
+        oldest_files = [f for f in backup_files if f not in files_to_keep]
+        
+        # 并行删除旧文件，每个删除请求都是一次独立的网络往返；单个文件删除失败不影响其他文件
+        def delete_backup(file_name):
+            file_to_delete = remote_path + file_name
             logger.info(f"删除旧备份文件: {file_to_delete}")
-            webdav_client.clean(file_to_delete)
+            try:
+                webdav_client.clean(file_to_delete)
+                return True
+            except Exception as e:
+                logger.error(f"删除旧备份文件 {file_to_delete} 时出错: {str(e)}")
+                return False
+            
+        with ThreadPoolExecutor(max_workers=CLEANUP_WORKERS) as executor:
+            deleted_count = sum(executor.map(delete_backup, oldest_files))
             
-        logger.info(f"清理完成，已删除{files_to_delete}个旧备份文件")
+        if deleted_count < files_to_delete:
+            logger.warning(f"清理完成，已删除{deleted_count}个旧备份文件，{files_to_delete - deleted_count}个删除失败")
+        else:
+            logger.info(f"清理完成，已删除{files_to_delete}个旧备份文件")
     except Exception as e:
         logger.error(f"清理旧备份文件时出错: {str(e)}")
         raise
 
-def backup_mysql_database(db_config, temp_dir):
-    """备份MySQL/MariaDB数据库"""
+def backup_mysql_database(db_config, webdav_client, remote_path, timestamp=None):
+    """备份MySQL/MariaDB数据库，导出内容经gzip压缩后直接流式上传到WebDAV，返回远程文件路径"""
     db_name = db_config['db_name']
     db_user = db_config['db_user']
     db_password = db_config['db_password']
@@ -276,11 +523,13 @@ def backup_mysql_database(db_config, temp_dir):
     
     logger.info(f"开始备份MySQL数据库: {db_name}")
     
-    # 生成备份文件名
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    backup_file = os.path.join(temp_dir, f"{db_name}_{timestamp}.sql")
+    # 生成备份文件名，同一项目的压缩包和数据库备份使用相同的时间戳
+    timestamp = timestamp or backup_timestamp()
+    remote_file_path = remote_path + f"{db_name}_{timestamp}.sql.gz"
     
     try:
+        import db_backup
+        
         cmd = [
             'mysqldump',
             f'--user={db_user}',
@@ -290,26 +539,24 @@ def backup_mysql_database(db_config, temp_dir):
             '--single-transaction',
             '--quick',
             '--lock-tables=false',
+            *db_backup.mysqldump_options(db_host),
             db_name
         ]
         
-        with open(backup_file, 'wb') as f:
-            process = subprocess.Popen(cmd, stdout=f, stderr=subprocess.PIPE)
-            _, stderr = process.communicate()
-            
-            if process.returncode != 0:
-                logger.error(f"备份MySQL数据库失败: {stderr.decode('utf-8')}")
-                return None
+        # 导出内容不在本地落盘，失败时已上传的不完整文件会被删除
+        if not db_backup.stream_dump_to_webdav(cmd, webdav_client, remote_file_path, compress=True):
+            logger.error(f"备份MySQL数据库失败: {db_name}")
+            return None
                 
-        logger.info(f"MySQL数据库备份成功: {backup_file}")
-        return backup_file
+        logger.info(f"MySQL数据库备份成功: {remote_file_path}")
+        return remote_file_path
             
     except Exception as e:
         logger.error(f"备份MySQL数据库出错: {str(e)}")
         return None
 
-def backup_postgresql_database(db_config, temp_dir):
-    """备份PostgreSQL数据库"""
+def backup_postgresql_database(db_config, webdav_client, remote_path, timestamp=None):
+    """备份PostgreSQL数据库，自定义格式的导出内容直接流式上传到WebDAV，返回远程文件路径"""
     db_name = db_config['db_name']
     db_user = db_config['db_user']
     db_password = db_config['db_password']
@@ -318,11 +565,13 @@ def backup_postgresql_database(db_config, temp_dir):
     
     logger.info(f"开始备份PostgreSQL数据库: {db_name}")
     
-    # 生成备份文件名
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    backup_file = os.path.join(temp_dir, f"{db_name}_{timestamp}.dump")
+    # 生成备份文件名，同一项目的压缩包和数据库备份使用相同的时间戳
+    timestamp = timestamp or backup_timestamp()
+    remote_file_path = remote_path + f"{db_name}_{timestamp}.dump"
     
     try:
+        import db_backup
+        
         # 处理密码中的特殊字符
         # 在环境变量中设置密码，避免命令行参数的问题
         env = os.environ.copy()
@@ -341,33 +590,27 @@ def backup_postgresql_database(db_config, temp_dir):
             '--verbose',      # 显示详细信息
             '--no-owner',     # 不输出所有者命令
             '--no-acl',       # 不输出访问权限命令
-            '--compress=9',   # 最高压缩级别
+            # 不指定--compress，自定义格式使用pg_dump的默认压缩级别；
+            # 最高级别9只比默认级别略小，却要多花数倍CPU时间，而且是单线程压缩
             db_name
         ]
         
         logger.info(f"执行PostgreSQL备份命令: {' '.join(cmd)}")
         
-        # 捕获标准输出和错误
-        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env)
-        stdout, stderr = process.communicate()
-        
-        if process.returncode != 0:
-            logger.error(f"备份PostgreSQL数据库失败: {stderr.decode('utf-8')}")
+        # 自定义格式已由pg_dump压缩，导出内容原样上传，不在内存中缓存整个导出结果
+        if not db_backup.stream_dump_to_webdav(cmd, webdav_client, remote_file_path, env=env):
+            logger.error(f"备份PostgreSQL数据库失败: {db_name}")
             return None
-            
-        # 将输出写入文件
-        with open(backup_file, 'wb') as f:
-            f.write(stdout)
                 
-        logger.info(f"PostgreSQL数据库备份成功: {backup_file}")
-        return backup_file
+        logger.info(f"PostgreSQL数据库备份成功: {remote_file_path}")
+        return remote_file_path
             
     except Exception as e:
         logger.error(f"备份PostgreSQL数据库出错: {str(e)}")
         return None
 
-def backup_mongodb_database(db_config, temp_dir):
-    """备份MongoDB数据库"""
+def backup_mongodb_database(db_config, webdav_client, remote_path, timestamp=None):
+    """备份MongoDB数据库，mongodump以gzip压缩的归档格式输出并直接流式上传到WebDAV，返回远程文件路径"""
     db_name = db_config['db_name']
     db_user = db_config.get('db_user')
     db_password = db_config.get('db_password')
@@ -376,14 +619,15 @@ def backup_mongodb_database(db_config, temp_dir):
     
     logger.info(f"开始备份MongoDB数据库: {db_name}")
     
-    # 生成备份文件名
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    backup_file = os.path.join(temp_dir, f"{db_name}_{timestamp}.zip")
+    # 生成备份文件名，同一项目的压缩包和数据库备份使用相同的时间戳
+    timestamp = timestamp or backup_timestamp()
+    remote_file_path = remote_path + f"{db_name}_{timestamp}.archive.gz"
     
     try:
-        dump_dir = tempfile.mkdtemp()
+        import db_backup
         
-        cmd = ['mongodump', f'--db={db_name}', f'--out={dump_dir}']
+        # 不指定--archive的路径时归档写到标准输出，由mongodump边导出边压缩，不再先导出到目录再打包
+        cmd = ['mongodump', f'--db={db_name}', '--archive', '--gzip']
         
         if db_user and db_password:
             cmd.append(f'--username={db_user}')
@@ -396,40 +640,26 @@ def backup_mongodb_database(db_config, temp_dir):
         if db_port:
             cmd.append(f'--port={db_port}')
             
-        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        _, stderr = process.communicate()
-        
-        if process.returncode != 0:
-            logger.error(f"备份MongoDB数据库失败: {stderr.decode('utf-8')}")
-            shutil.rmtree(dump_dir, ignore_errors=True)
+        if not db_backup.stream_dump_to_webdav(cmd, webdav_client, remote_file_path):
+            logger.error(f"备份MongoDB数据库失败: {db_name}")
             return None
-            
-        # 创建压缩文件
-        shutil.make_archive(
-            backup_file.replace('.zip', ''),
-            'zip',
-            dump_dir
-        )
-        
-        # 清理临时目录
-        shutil.rmtree(dump_dir, ignore_errors=True)
         
-        logger.info(f"MongoDB数据库备份成功: {backup_file}")
-        return backup_file
+        logger.info(f"MongoDB数据库备份成功: {remote_file_path}")
+        return remote_file_path
             
     except Exception as e:
         logger.error(f"备份MongoDB数据库出错: {str(e)}")
         return None
 
-def backup_sqlite_database(db_config, temp_dir):
+def backup_sqlite_database(db_config, temp_dir, timestamp=None):
     """备份SQLite数据库"""
     db_name = db_config['db_name']
     db_file = db_config['db_file']
     
     logger.info(f"开始备份SQLite数据库: {db_file}")
     
-    # 生成备份文件名
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    # 生成备份文件名，同一项目的压缩包和数据库备份使用相同的时间戳
+    timestamp = timestamp or backup_timestamp()
     backup_file = os.path.join(temp_dir, f"{db_name}_{timestamp}.db")
     
     try:
@@ -437,8 +667,25 @@ def backup_sqlite_database(db_config, temp_dir):
             logger.error(f"SQLite数据库文件不存在: {db_file}")
             return None
             
-        # 直接复制数据库文件
-        shutil.copy2(db_file, backup_file)
+        if sqlite3 is None:
+            # 直接复制数据库文件
+            shutil.copy2(db_file, backup_file)
+            logger.info(f"SQLite数据库备份成功: {backup_file}")
+            return backup_file
+            
+        # 使用SQLite在线备份接口按页复制，数据库正在被写入时也能得到一致的快照；
+        # 源数据库以只读方式打开，备份过程不会修改或意外创建源文件
+        src = sqlite3.connect(f"{Path(db_file).resolve().as_uri()}?mode=ro", uri=True)
+        dst = sqlite3.connect(backup_file)
+        try:
+            # 目标文件只是上传前的临时副本，不需要日志和同步写入
+            dst.execute('PRAGMA journal_mode=OFF')
+            dst.execute('PRAGMA synchronous=OFF')
+            with dst:
+                src.backup(dst, pages=SQLITE_BACKUP_PAGES)
+        finally:
+            dst.close()
+            src.close()
         
         logger.info(f"SQLite数据库备份成功: {backup_file}")
         return backup_file
@@ -447,38 +694,71 @@ def backup_sqlite_database(db_config, temp_dir):
         logger.error(f"备份SQLite数据库出错: {str(e)}")
         return None
 
-def backup_project(project_config, webdav_config):
-    """备份单个项目"""
+def backup_project(project_config, webdav_client):
+    """使用共用的WebDAV客户端备份单个项目"""
     project_name = project_config['project_name']
     hf_token = project_config['hf_token']
     backup_path = project_config['backup_path']
     max_backups = int(project_config.get('max_backups', 2))
     hf_type = project_config.get('hf_type', None)  # 从配置中获取存储库类型
+    dl_workers = max(1, int(project_config.get('dl_workers', HF_DOWNLOAD_WORKERS)))  # 并行下载的文件数
     
     logger.info(f"开始备份项目: {project_name}")
     
     # 默认使用项目短名称作为文件前缀
-    project_short_name = project_name.split('/')[-1]
+    project_short_name = project_name.rsplit('/', 1)[-1]
+    
+    # 本次备份的所有文件使用同一个时间戳
+    run_timestamp = backup_timestamp()
     file_prefix = project_short_name
     
     # 存储检测到的真实文件前缀，用于后续清理
     detected_prefix = None
     
     try:
-        # 创建WebDAV客户端
-        webdav_client = setup_webdav_client(
-            webdav_config['url'],
-            webdav_config['username'],
-            webdav_config['password']
-        )
-        
-        # 创建临时目录
-        with tempfile.TemporaryDirectory() as temp_dir:
-            # 下载数据集，使用配置的存储库类型
-            dataset_dir = download_dataset(project_name, hf_token, temp_dir, hf_type)
+        # 先获取存储库信息，修订版本与最新备份一致时跳过下载、打包和上传
+        try:
+            repo = get_repo_info(project_name, hf_token, hf_type)
+        except Exception as e:
+            logger.error(f"获取项目 {project_name} 的存储库信息时出错: {str(e)}")
+            repo = None
+            
+        revision = repo[1].sha if repo else None
+        if revision and latest_backup_revision(webdav_client, backup_path, file_prefix) == revision[:REVISION_LENGTH]:
+            logger.info(f"项目 {project_name} 的修订版本 {revision[:REVISION_LENGTH]} 未变化，跳过下载和上传")
+            goto_db_backup = 'db_type' in project_config
+        else:
+            archive_path = None
+            streamed = False
+            
+            if repo and not any(f.endswith(ARCHIVE_EXTENSIONS) for f in repo[2]):
+                # 存储库中没有现成的压缩包时逐个下载文件，下载、打包和上传同时进行，不必等整个存储库下载完成
+                entries = repo_archive_entries(repo[2], revision or project_short_name)
+                build_record = functools.partial(build_repo_tar_record, project_name, hf_token, repo[0], revision)
+                try:
+                    logger.info(f"开始下载数据集并创建压缩文件: {file_prefix}")
+                    stream_archive_to_webdav(
+                        webdav_client,
+                        lambda output: write_tar_stream(output, entries, build_record, dl_workers),
+                        file_prefix,
+                        backup_path,
+                        revision,
+                        archive_compresslevel(repo[2]),
+                        run_timestamp
+                    )
+                    streamed = True
+                except UploadNotStartedError as e:
+                    # 尚未上传任何数据时才视为下载失败，转而检查WebDAV中的现有备份
+                    logger.error(f"下载数据集时出错: {str(e)}")
+                except Exception as e:
+                    logger.error(f"上传项目 {project_name} 的备份时出错: {str(e)}")
+                    return False
+            elif repo:
+                # 存储库中有现成的压缩包时只下载最新的一个；无法访问存储库时直接检查WebDAV中的现有备份
+                archive_path = download_dataset(project_name, hf_token, repo)
             
             # 如果数据集下载失败，但WebDAV已有备份，则可以跳过下载步骤
-            if not dataset_dir:
+            if not streamed and not archive_path:
                 logger.warning(f"无法从HuggingFace下载项目 {project_name}，检查WebDAV是否已有备份")
                 # 检查WebDAV中是否已有备份
                 try:
@@ -494,8 +774,7 @@ def backup_project(project_config, webdav_config):
                     
                     for prefix in possible_prefixes:
                         for f in remote_files:
-                            if (f.startswith(f"{prefix}_backup_") or f.startswith(f"{prefix}_20")) and \
-                               (f.endswith('.zip') or f.endswith('.tar.gz') or f.endswith('.7z')):
+                            if f.startswith((f"{prefix}_backup_", f"{prefix}_20")) and f.endswith(ARCHIVE_EXTENSIONS):
                                 backup_found = True
                                 detected_prefix = prefix
                                 logger.info(f"在WebDAV中找到项目 {project_name} 的现有备份，使用前缀: {prefix}")
@@ -524,28 +803,17 @@ def backup_project(project_config, webdav_config):
                     return False
             else:
                 # 正常处理下载的数据集
-                if os.path.isdir(dataset_dir):
-                    # 创建压缩文件
-                    logger.info(f"创建压缩文件: {file_prefix}")
-                    archive_path = create_archive(dataset_dir, file_prefix)
+                if streamed:
+                    logger.info(f"项目 {project_name} 的文件已边下载边打包上传")
                 else:
                     # 使用已下载的压缩文件，并从文件名中提取前缀
-                    basename = os.path.basename(dataset_dir)
+                    basename = os.path.basename(archive_path)
                     logger.info(f"使用已下载的压缩文件: {basename}")
-                    archive_path = dataset_dir
                     
-                    # 从文件名中提取前缀，通常格式为 prefix_backup_timestamp.ext
-                    parts = basename.split('_')
-                    if len(parts) > 1:
-                        # 提取前缀（可能是多个部分）
-                        # 假设格式为 prefix_backup_timestamp.ext 或 prefix_timestamp.ext
-                        if 'backup' in parts:
-                            backup_index = parts.index('backup')
-                            detected_prefix = '_'.join(parts[:backup_index])
-                        else:
-                            # 假设最后一部分是时间戳，前面都是前缀
-                            detected_prefix = '_'.join(parts[:-1])
-                        
+                    # 从文件名中提取前缀，格式为 prefix_backup_timestamp.ext 或 prefix_timestamp.ext
+                    match = ARCHIVE_PREFIX_PATTERN.match(basename)
+                    if match:
+                        detected_prefix = match.group('prefix')
                         logger.info(f"从文件名 {basename} 中检测到前缀: {detected_prefix}")
                     
                     # 如果无法提取前缀，使用默认前缀
@@ -556,9 +824,9 @@ def backup_project(project_config, webdav_config):
                         else:
                             detected_prefix = project_short_name
                         logger.info(f"无法从文件名提取前缀，使用默认前缀: {detected_prefix}")
-                
-                # 上传文件到WebDAV
-                upload_to_webdav(webdav_client, archive_path, backup_path)
+                        
+                    # 上传文件到WebDAV
+                    upload_to_webdav(webdav_client, archive_path, backup_path)
                 
                 # 清理旧的备份文件
                 # 使用检测到的前缀而不是项目名
@@ -577,28 +845,18 @@ def backup_project(project_config, webdav_config):
             logger.info(f"为项目 {project_name} 备份 {db_type} 数据库")
             db_backup_success = False
             
-            # 创建临时目录
-            with tempfile.TemporaryDirectory() as temp_dir:
-                # 根据数据库类型备份
+            if db_type in ('mysql', 'postgresql', 'mongodb'):
+                # MySQL、PostgreSQL和MongoDB的导出结果直接流式上传，不在本地落盘
+                create_remote_dirs(webdav_client, db_backup_path)
+                
                 if db_type == 'mysql':
-                    db_file = backup_mysql_database(project_config, temp_dir)
+                    remote_db_file = backup_mysql_database(project_config, webdav_client, db_backup_path, run_timestamp)
                 elif db_type == 'postgresql':
-                    db_file = backup_postgresql_database(project_config, temp_dir)
-                elif db_type == 'mongodb':
-                    db_file = backup_mongodb_database(project_config, temp_dir)
-                elif db_type == 'sqlite':
-                    db_file = backup_sqlite_database(project_config, temp_dir)
+                    remote_db_file = backup_postgresql_database(project_config, webdav_client, db_backup_path, run_timestamp)
                 else:
-                    logger.error(f"不支持的数据库类型: {db_type}")
-                    db_file = None
-                
-                if db_file:
-                    # 确保远程目录存在
-                    create_remote_dirs(webdav_client, db_backup_path)
-                    
-                    # 上传数据库备份文件
-                    upload_to_webdav(webdav_client, db_file, db_backup_path)
+                    remote_db_file = backup_mongodb_database(project_config, webdav_client, db_backup_path, run_timestamp)
                     
+                if remote_db_file:
                     # 清理旧的数据库备份文件
                     cleanup_old_backups(webdav_client, db_backup_path, db_name, max_backups, is_db=True, is_project=False)
                     
@@ -606,6 +864,30 @@ def backup_project(project_config, webdav_config):
                 else:
                     logger.error(f"数据库备份失败")
                     
+            else:
+                # 创建临时目录
+                with tempfile.TemporaryDirectory() as temp_dir:
+                    # 根据数据库类型备份
+                    if db_type == 'sqlite':
+                        db_file = backup_sqlite_database(project_config, temp_dir, run_timestamp)
+                    else:
+                        logger.error(f"不支持的数据库类型: {db_type}")
+                        db_file = None
+                    
+                    if db_file:
+                        # 确保远程目录存在
+                        create_remote_dirs(webdav_client, db_backup_path)
+                        
+                        # 上传数据库备份文件
+                        upload_to_webdav(webdav_client, db_file, db_backup_path)
+                        
+                        # 清理旧的数据库备份文件
+                        cleanup_old_backups(webdav_client, db_backup_path, db_name, max_backups, is_db=True, is_project=False)
+                        
+                        db_backup_success = True
+                    else:
+                        logger.error(f"数据库备份失败")
+                    
             if not db_backup_success:
                 logger.error(f"项目 {project_name} 备份失败: 数据库备份失败")
                 return False
@@ -672,16 +954,35 @@ def main():
     success_count = 0
     failure_count = 0
     
-    # 备份项目
-    for project_config in projects:
-        result = backup_project(project_config, webdav_config)
-        
-        if result:
-            logger.info(f"项目 {project_config['project_name']} 备份成功")
-            success_count += 1
-        else:
-            logger.error(f"项目 {project_config['project_name']} 备份失败")
-            failure_count += 1
+    # 所有项目共用一个WebDAV客户端，已确认存在的目录和已列出的目录在整个运行期间只请求一次
+    # 每个并行任务清理旧备份时最多同时发出CLEANUP_WORKERS个删除请求，连接池按此扩大以保持连接复用
+    set_http_pool_size(max(1, args.parallel) * CLEANUP_WORKERS)
+    webdav_client = setup_webdav_client(
+        webdav_config['url'],
+        webdav_config['username'],
+        webdav_config['password']
+    )
+    
+    # 各项目的备份主要耗时在网络传输上，使用线程池并行备份；每个任务使用各自的临时目录
+    with ThreadPoolExecutor(max_workers=max(1, args.parallel)) as executor:
+        # 先并行创建所有项目的备份目录，之后各项目的备份任务不再需要检查或创建目录
+        backup_paths = sorted({project_config['backup_path'] for project_config in projects if 'backup_path' in project_config})
+        list(executor.map(lambda path: create_remote_dirs(webdav_client, path), backup_paths))
+        
+        futures = {
+            executor.submit(backup_project, project_config, webdav_client): project_config
+            for project_config in projects
+        }
+        
+        for future in as_completed(futures):
+            project_config = futures[future]
+            
+            if future.result():
+                logger.info(f"项目 {project_config['project_name']} 备份成功")
+                success_count += 1
+            else:
+                logger.error(f"项目 {project_config['project_name']} 备份失败")
+                failure_count += 1
     
     logger.info(f"所有备份任务完成。成功: {success_count}, 失败: {failure_count}")
 
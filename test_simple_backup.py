@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+
+import os
+import tempfile
+import types
+import unittest
+from unittest import mock
+
+import simple_backup
+
+OLD_ARCHIVE = 'proj_backup_20240101_000000_aaaaaaa.tar.gz'
+
+class FakeWebdav:
+    """只记录调用的WebDAV客户端，目录中已有一个旧的项目备份"""
+
+    def __init__(self, fail_upload=False):
+        self.files = [OLD_ARCHIVE]
+        self.fail_upload = fail_upload
+        self.uploaded = []
+        self.deleted = []
+
+    def ensure_dir(self, remote_path):
+        pass
+
+    def list(self, remote_path):
+        return list(self.files)
+
+    def modified_times(self, remote_path):
+        return {}
+
+    def clean(self, remote_path):
+        self.deleted.append(remote_path)
+
+    def upload_stream(self, chunks, remote_file_path):
+        # 读到第一个数据块后才失败，模拟上传过程中断开的PUT请求
+        next(chunks)
+        if self.fail_upload:
+            raise IOError("PUT请求失败")
+        for _ in chunks:
+            pass
+        self.uploaded.append(remote_file_path)
+
+class BackupProjectTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.data_file = os.path.join(self.temp_dir.name, 'data.bin')
+        # 随机数据几乎无法压缩，保证压缩后超过一个上传块
+        with open(self.data_file, 'wb') as f:
+            f.write(os.urandom(simple_backup.UPLOAD_CHUNK_SIZE + 1024 * 1024))
+
+        repo = ('dataset', types.SimpleNamespace(sha='b' * 40), ['data.bin'])
+        patches = [
+            mock.patch.object(simple_backup, 'get_repo_info', return_value=repo),
+            mock.patch.object(simple_backup, 'PIGZ_PATH', None),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.addCleanup(self.temp_dir.cleanup)
+
+        self.project_config = {
+            'project_name': 'acct/proj',
+            'hf_token': 'token',
+            'backup_path': '/backup/proj/',
+            'max_backups': '2',
+        }
+
+    def run_backup(self, webdav_client, hf_hub_download):
+        hf_api = types.SimpleNamespace(hf_hub_download=hf_hub_download)
+        with mock.patch.object(simple_backup, 'get_hf_api', return_value=hf_api):
+            return simple_backup.backup_project(self.project_config, webdav_client)
+
+    def test_upload_failure_is_reported_even_with_existing_backup(self):
+        webdav_client = FakeWebdav(fail_upload=True)
+        result = self.run_backup(webdav_client, lambda **kwargs: self.data_file)
+        self.assertFalse(result)
+        self.assertEqual(webdav_client.uploaded, [])
+
+    def test_download_failure_falls_back_to_existing_backup(self):
+        def hf_hub_download(**kwargs):
+            raise OSError("下载失败")
+
+        webdav_client = FakeWebdav()
+        result = self.run_backup(webdav_client, hf_hub_download)
+        self.assertTrue(result)
+        self.assertEqual(webdav_client.uploaded, [])
+        self.assertEqual(webdav_client.deleted, [])
+
+    def test_successful_upload(self):
+        webdav_client = FakeWebdav()
+        result = self.run_backup(webdav_client, lambda **kwargs: self.data_file)
+        self.assertTrue(result)
+        self.assertEqual(len(webdav_client.uploaded), 1)
+
+if __name__ == '__main__':
+    unittest.main()
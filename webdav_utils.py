@@ -0,0 +1,406 @@
+# -*- coding: utf-8 -*-
+
+import io
+import itertools
+import email.utils
+import http.cookiejar
+import logging
+import os
+import posixpath
+import queue
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from webdav3.client import WebDavXmlUtils
+from webdav3.exceptions import MethodNotSupported, RemoteResourceNotFound
+from webdav3.urn import Urn
+
+# 所有WebDAV客户端共用的HTTP连接池大小，不小于并发上传/删除的线程数
+WEBDAV_POOL_SIZE = 8
+
+# WebDAV请求的(连接超时, 读取超时)，单位为秒：服务器无法连接时尽快失败并重试，传输停滞超过读取超时后报错，不会无限期挂起
+WEBDAV_TIMEOUT = (10, 300)
+
+# 列出目录时只请求用到的属性，不让服务器按allprop返回每个文件的全部属性
+LIST_PROPFIND_BODY = (
+    b'<?xml version="1.0" encoding="utf-8"?>'
+    b'<d:propfind xmlns:d="DAV:"><d:prop><d:resourcetype/><d:getlastmodified/></d:prop></d:propfind>'
+)
+
+# 建立连接失败时的重试次数，只重试连接阶段：此时请求体尚未发送，流式上传的请求体不会被消耗
+WEBDAV_CONNECT_RETRIES = 3
+
+def _mount_http_adapter(session, pool_size):
+    """为会话挂载指定连接池大小的适配器"""
+    retries = Retry(total=WEBDAV_CONNECT_RETRIES, connect=WEBDAV_CONNECT_RETRIES, read=0, status=0, other=0, backoff_factor=0.5)
+    adapter = HTTPAdapter(pool_connections=WEBDAV_POOL_SIZE, pool_maxsize=pool_size, max_retries=retries)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+
+def _create_http_session():
+    """创建带连接池的HTTP会话，同一进程内的WebDAV请求复用TCP/TLS连接
+
+    会话不保存任何cookie：服务器设置的会话cookie属于某个账号，保存下来会随其他账号的请求一起发送
+    """
+    session = requests.Session()
+    session.cookies.set_policy(http.cookiejar.DefaultCookiePolicy(allowed_domains=[]))
+    _mount_http_adapter(session, WEBDAV_POOL_SIZE)
+    return session
+
+# 认证信息由webdav3按请求传入，会话又不保存cookie，因此不同账号的客户端共用的只有连接池
+HTTP_SESSION = _create_http_session()
+_http_pool_size = WEBDAV_POOL_SIZE
+
+def set_http_pool_size(pool_size):
+    """按并发请求数增大共用连接池，超出连接池大小的连接用完即关闭，无法复用；需在发出请求之前调用"""
+    global _http_pool_size
+    if pool_size > _http_pool_size:
+        _mount_http_adapter(HTTP_SESSION, pool_size)
+        _http_pool_size = pool_size
+
+logger = logging.getLogger("webdav_utils")
+
+# 上传本地文件时每次读取并发送的数据块大小，也是流式上传的数据块大小
+UPLOAD_CHUNK_SIZE = 4 * 1024 * 1024
+
+# 流式上传时写入端与上传请求之间最多缓存的数据块数量（共32MB），足以吸收打包压缩的突发输出和上传请求的网络停顿，
+# 双方速度不一致时互不阻塞；每个并行上传各占一份，不宜设得过大
+UPLOAD_QUEUE_SIZE = 8
+
+class FileChunks:
+    """按大块读取本地文件的请求体
+
+    直接传文件对象时http.client每次只发送8KB；提供__len__使requests带上Content-Length而不是使用分块传输编码
+    """
+
+    def __init__(self, local_path, chunk_size=UPLOAD_CHUNK_SIZE):
+        self.local_path = local_path
+        self.chunk_size = chunk_size
+
+    def __len__(self):
+        return os.path.getsize(self.local_path)
+
+    def __iter__(self):
+        with open(self.local_path, 'rb', buffering=0) as f:
+            while True:
+                chunk = f.read(self.chunk_size)
+                if not chunk:
+                    return
+                yield chunk
+
+class ChunkQueueWriter(io.RawIOBase):
+    """只写的类文件对象，写入的数据按块放入队列，供上传请求作为请求体逐块读取"""
+
+    def __init__(self, chunk_size=UPLOAD_CHUNK_SIZE, maxsize=UPLOAD_QUEUE_SIZE):
+        super().__init__()
+        self._chunk_size = chunk_size
+        self._queue = queue.Queue(maxsize)
+        self._buffer = bytearray()
+        self._aborted = threading.Event()
+
+    def writable(self):
+        return True
+
+    def _put(self, item):
+        # 上传中止后不再阻塞等待队列空位，避免压缩线程永远挂起
+        while True:
+            if self._aborted.is_set():
+                raise IOError("上传已中止")
+            try:
+                self._queue.put(item, timeout=1)
+                return
+            except queue.Full:
+                continue
+
+    def write(self, data):
+        self._buffer += data
+        while len(self._buffer) >= self._chunk_size:
+            self._put(bytes(self._buffer[:self._chunk_size]))
+            del self._buffer[:self._chunk_size]
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            try:
+                if self._buffer:
+                    self._put(bytes(self._buffer))
+                    self._buffer.clear()
+            finally:
+                # 无论压缩是否成功都要放入结束标记，使上传请求能够结束
+                if not self._aborted.is_set():
+                    self._queue.put(None)
+                super().close()
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            # 写入端出错时丢弃尚未放入队列的数据，只放入结束标记
+            self._buffer.clear()
+        self.close()
+
+    def abort(self):
+        """上传失败时调用，使写入端立即报错退出"""
+        self._aborted.set()
+
+    def chunks(self):
+        """按顺序返回写入的数据块，直到写入端关闭"""
+        while True:
+            chunk = self._queue.get()
+            if chunk is None:
+                return
+            yield chunk
+
+class UploadNotStartedError(IOError):
+    """写入端在产生第一个数据块之前出错，尚未向服务器发送任何数据"""
+
+def upload_from_writer(webdav_client, remote_file_path, write_body):
+    """在后台线程中调用write_body(writer)写入请求体，同时流式上传到WebDAV，数据不在本地落盘
+
+    写入端出错时删除已上传的不完整文件并重新抛出异常；尚未发送任何数据时抛出UploadNotStartedError
+    """
+    writer = ChunkQueueWriter()
+    errors = []
+    
+    def produce():
+        try:
+            with writer:
+                write_body(writer)
+        except BaseException as e:
+            errors.append(e)
+            
+    producer = threading.Thread(target=produce, name="archive-writer", daemon=True)
+    producer.start()
+    
+    # 等第一个数据块就绪后再发起上传请求，避免准备数据期间服务器因收不到请求体而超时
+    chunks = writer.chunks()
+    first_chunk = next(chunks, None)
+    if first_chunk is None:
+        producer.join()
+        if errors:
+            raise UploadNotStartedError(str(errors[0])) from errors[0]
+        raise IOError("上传内容为空")
+        
+    try:
+        webdav_client.upload_stream(itertools.chain([first_chunk], chunks), remote_file_path)
+    except Exception:
+        writer.abort()
+        producer.join()
+        raise
+    producer.join()
+    
+    if errors:
+        # 删除已上传的不完整文件
+        try:
+            webdav_client.clean(remote_file_path)
+        except Exception as e:
+            logger.warning(f"删除不完整的备份文件时出错: {str(e)}")
+        raise errors[0]
+
+class WebdavSession:
+    """包装webdav3客户端，在一次备份过程中缓存目录列表，避免对同一目录重复发送PROPFIND请求"""
+
+    def __init__(self, client):
+        self.client = client
+        self.client.session = HTTP_SESSION
+        self._listing_cache = {}
+        # 与目录列表一起缓存的文件修改时间（时间戳），来自同一次PROPFIND请求
+        self._modified_cache = {}
+        self._known_dirs = set()
+        self._lock = threading.Lock()
+        # 每个目录一把锁，列出目录的请求期间只阻塞同一目录的操作
+        self._dir_locks = {}
+
+    def __getattr__(self, name):
+        # 未包装的方法直接转发给底层客户端
+        return getattr(self.client, name)
+
+    def _request(self, action, path, data=None, headers_ext=None):
+        """发送请求并读完响应体
+
+        webdav3以stream=True发送请求，响应体未读完时连接不会归还连接池
+        """
+        response = self.client.execute_request(action=action, path=path, data=data, headers_ext=headers_ext)
+        response.content
+        return response
+
+    @staticmethod
+    def _dir_key(remote_path):
+        """统一目录路径格式作为缓存键"""
+        return remote_path if remote_path.endswith('/') else remote_path + '/'
+
+    def _dir_lock(self, dir_key):
+        """返回指定目录的锁"""
+        with self._lock:
+            return self._dir_locks.setdefault(dir_key, threading.Lock())
+
+    def _update_listing(self, remote_file_path, add, modified_time=None):
+        """上传或删除文件后同步更新已缓存的目录列表，modified_time为服务器时钟下上传文件的修改时间"""
+        dir_key = self._dir_key(posixpath.dirname(remote_file_path))
+        filename = posixpath.basename(remote_file_path)
+
+        with self._dir_lock(dir_key), self._lock:
+            listing = self._listing_cache.get(dir_key)
+            if listing is None:
+                return
+            modified = self._modified_cache.setdefault(dir_key, {})
+            if add:
+                if filename not in listing:
+                    listing.append(filename)
+                # 不使用本机时间：与其他文件的服务器修改时间混在一起比较时，两边时钟的偏差会打乱新旧顺序
+                if modified_time is None:
+                    modified.pop(filename, None)
+                else:
+                    modified[filename] = modified_time
+            else:
+                if filename in listing:
+                    listing.remove(filename)
+                modified.pop(filename, None)
+
+    @staticmethod
+    def _parse_modified(text):
+        """将getlastmodified的HTTP日期转换为时间戳，无法解析时返回None"""
+        if not text:
+            return None
+        try:
+            return email.utils.parsedate_to_datetime(text).timestamp()
+        except (TypeError, ValueError):
+            return None
+
+    def _response_modified(self, response):
+        """从上传请求的响应头读取服务器时钟下的修改时间：优先Last-Modified，其次Date"""
+        for header in ('Last-Modified', 'Date'):
+            modified_time = self._parse_modified(response.headers.get(header))
+            if modified_time is not None:
+                return modified_time
+        return None
+
+    def _propfind_listing(self, remote_path):
+        """用一次Depth为1的PROPFIND请求列出目录，返回(文件名列表, {文件名: 修改时间})，目录不存在时抛出RemoteResourceNotFound
+
+        webdav3的list会先单独发送一次请求检查目录是否存在，这里由PROPFIND本身的404判断
+        """
+        directory_urn = Urn(remote_path, directory=True)
+        path = Urn.normalize_path(self.client.get_full_path(directory_urn))
+        response = self._request(
+            'list',
+            directory_urn.quote(),
+            data=LIST_PROPFIND_BODY,
+            headers_ext=['Content-Type: application/xml; charset="utf-8"']
+        )
+        
+        listing = []
+        modified = {}
+        for info in WebDavXmlUtils.parse_get_list_info_response(response.content):
+            urn = Urn(Urn.separate + info['path'], info['isdir'])
+            if Urn.compare_path(path, urn.path()) is not False:
+                continue
+            filename = urn.filename()
+            listing.append(filename)
+            modified_time = self._parse_modified(info.get('modified'))
+            if modified_time is not None:
+                modified[filename] = modified_time
+        return listing, modified
+
+    def list(self, remote_path):
+        """列出远程目录中的文件，同一目录只请求一次"""
+        dir_key = self._dir_key(remote_path)
+
+        # 请求期间持有该目录的锁，多个线程共用客户端时不会用过期的列表覆盖其他线程已更新的缓存
+        with self._dir_lock(dir_key):
+            with self._lock:
+                listing = self._listing_cache.get(dir_key)
+                if listing is not None:
+                    return list(listing)
+                    
+            listing, modified = self._propfind_listing(remote_path)
+            with self._lock:
+                self._listing_cache[dir_key] = listing
+                self._modified_cache[dir_key] = modified
+                self._known_dirs.add(dir_key)
+                return list(listing)
+
+    def modified_times(self, remote_path):
+        """返回远程目录中文件的修改时间（时间戳），与list共用同一次请求；服务器未提供修改时间的文件不在其中"""
+        self.list(remote_path)
+        with self._lock:
+            return dict(self._modified_cache.get(self._dir_key(remote_path), {}))
+
+    def check(self, remote_path):
+        """检查远程资源是否存在，已缓存列表的目录无需再次请求"""
+        with self._lock:
+            if self._dir_key(remote_path) in self._listing_cache:
+                return True
+        
+        try:
+            response = self._request('check', Urn(remote_path).quote())
+        except RemoteResourceNotFound:
+            return False
+        return int(response.status_code) == 200
+
+    def ensure_dir(self, remote_path):
+        """确保远程目录及其上级目录存在，已确认存在的目录记入集合，之后不再发送请求
+
+        目标目录本身通过列出其内容来确认是否存在，之后查找已有备份和清理旧备份时直接使用缓存的列表
+        """
+        dir_key = self._dir_key(remote_path)
+        with self._lock:
+            if dir_key in self._known_dirs:
+                return
+        try:
+            self.list(dir_key)
+            return
+        except RemoteResourceNotFound:
+            pass
+            
+        # 一次拆分出全部上级目录（由深到浅），不再逐级调用dirname
+        parts = [part for part in dir_key.split('/') if part]
+        root = '/' if dir_key.startswith('/') else ''
+        ancestors = [root + '/'.join(parts[:depth]) + '/' for depth in range(len(parts) - 1, 0, -1)]
+        
+        walked = [dir_key]
+        existing_dir = None
+        
+        # 从最深一级向上查找第一个已存在的目录，多个任务共用前缀时只有第一次需要请求
+        for parent_dir in ancestors:
+            with self._lock:
+                if parent_dir in self._known_dirs:
+                    existing_dir = parent_dir
+                    break
+            if self.check(parent_dir):
+                existing_dir = parent_dir
+                break
+            walked.append(parent_dir)
+            
+        for missing_dir in reversed(walked):
+            self.mkdir(missing_dir)
+            
+        with self._lock:
+            self._known_dirs.update(walked)
+            if existing_dir is not None:
+                self._known_dirs.add(existing_dir)
+            # 新建的目标目录为空，之后列出时无需请求
+            self._listing_cache.setdefault(walked[0], [])
+
+    def mkdir(self, remote_path):
+        """创建远程目录，调用前需确保上级目录已存在"""
+        try:
+            response = self._request('mkdir', Urn(remote_path, directory=True).quote())
+        except MethodNotSupported:
+            # 部分服务器在目录已存在时返回405
+            return True
+        return response.status_code in (200, 201)
+
+    def upload_sync(self, remote_path, local_path):
+        """上传本地文件，调用前需确保远程目录已存在"""
+        response = self._request('upload', Urn(remote_path).quote(), data=FileChunks(local_path))
+        self._update_listing(remote_path, add=True, modified_time=self._response_modified(response))
+
+    def upload_stream(self, chunks, remote_path):
+        """将数据块迭代器作为请求体上传（分块传输编码），调用前需确保远程目录已存在"""
+        response = self._request('upload', Urn(remote_path).quote(), data=chunks)
+        self._update_listing(remote_path, add=True, modified_time=self._response_modified(response))
+
+    def clean(self, remote_path):
+        """删除远程资源"""
+        self._request('clean', Urn(remote_path).quote())
+        self._update_listing(remote_path, add=False)